@@ -0,0 +1,292 @@
+# On-disk HTTP response cache shared by the extractors
+
+import os
+import json
+import time
+import hashlib
+import threading
+import requests
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+
+# TTL in seconds per endpoint, matched as URL substrings (first match wins)
+DEFAULT_TTLS = {
+    "eodhistoricaldata.com/api/exchange-symbol-list": 24 * 3600,
+    "eodhistoricaldata.com/api/exchange-details": 24 * 3600,
+    "eodhistoricaldata.com/api/technical": 6 * 3600,
+    "data.census.gov/api/search/metadata": 7 * 24 * 3600,
+    "data.census.gov/api/access/data": 24 * 3600,
+    "sidofqa.segob.gob.mx/dof/sidof/diarios": 3600,
+    "sidofqa.segob.gob.mx/dof/sidof/notas": 3600,
+    "cloud.iexapis.com": 60,
+}
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "api-extractions",
+)
+
+# Query parameters that carry API credentials, never written to disk
+CREDENTIAL_PARAMS = ("api_token", "token", "apikey", "key")
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def strip_credentials(url):
+    """
+    Returns a URL without its CREDENTIAL_PARAMS query parameters
+    """
+    parts = urlsplit(url)
+    if not parts.query:
+        return url
+    query = [
+        (name, value)
+        for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if name.lower() not in CREDENTIAL_PARAMS
+    ]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+class CachedResponse:
+    """
+    Response served from the cache, exposing the parts of
+    requests.Response used by the extractors
+    """
+
+    def __init__(self, url, status_code, headers, content):
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.from_cache = True
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError(f"{self.status_code} Error for url: {self.url}")
+
+
+class ResponseCache:
+    """
+    Size-bounded on-disk cache of GET responses
+
+    Entries expire after a per-endpoint TTL. Expired entries that carry
+    an ETag or Last-Modified header are revalidated with a conditional
+    request instead of being downloaded again. When the cache grows
+    over `max_bytes` the least recently used entries are evicted.
+
+    Entries are keyed by the URL without its credential parameters, and
+    the folder and its files are only readable by the current user.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Folder where entries are stored
+    ttls : dict, optional
+        URL substring -> TTL in seconds, defaults to DEFAULT_TTLS
+    default_ttl : float, optional
+        TTL for URLs with no match in `ttls`; 0 disables caching
+    max_bytes : int, optional
+        Maximum size of the cache on disk
+    """
+
+    def __init__(
+        self,
+        cache_dir=DEFAULT_CACHE_DIR,
+        ttls=None,
+        default_ttl=0,
+        max_bytes=1024**3,
+    ):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, mode=0o700, exist_ok=True)
+        os.chmod(self.cache_dir, 0o700)
+        self.ttls = DEFAULT_TTLS if ttls is None else ttls
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+        self.evictions = 0
+        self.size = sum(
+            os.path.getsize(os.path.join(self.cache_dir, name))
+            for name in os.listdir(self.cache_dir)
+        )
+
+    def ttl_for(self, url):
+        """
+        Returns the TTL configured for a URL
+        """
+        for pattern, ttl in self.ttls.items():
+            if pattern in url:
+                return ttl
+        return self.default_ttl
+
+    def _paths(self, url):
+        key = hashlib.sha256(strip_credentials(url).encode("utf-8")).hexdigest()
+        base = os.path.join(self.cache_dir, key)
+        return base + ".body", base + ".json"
+
+    def _load(self, url):
+        body_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as file:
+                meta = json.load(file)
+            with open(body_path, "rb") as file:
+                content = file.read()
+        except (OSError, ValueError):
+            return None, None
+        return meta, content
+
+    def _write(self, path, data):
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.size += len(data) - old_size
+
+    def _store(self, url, response, content=None):
+        body_path, meta_path = self._paths(url)
+        if content is None:
+            content = response.content
+            self._write(body_path, content)
+        meta = {
+            "url": strip_credentials(url),
+            "stored": time.time(),
+            "status_code": response.status_code,
+            "headers": {
+                name: response.headers[name]
+                for name in ["Content-Type", "ETag", "Last-Modified"]
+                if name in response.headers
+            },
+        }
+        self._write(meta_path, json.dumps(meta).encode("utf-8"))
+        self._evict()
+        return meta
+
+    def _touch(self, url):
+        _, meta_path = self._paths(url)
+        try:
+            os.utime(meta_path)
+        except OSError:
+            pass
+
+    def _evict(self):
+        """
+        Removes least recently used entries until the cache fits in max_bytes
+        """
+        with self.lock:
+            if self.size <= self.max_bytes:
+                return
+            entries = []
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".json"):
+                    path = os.path.join(self.cache_dir, name)
+                    entries.append((os.path.getmtime(path), path[: -len(".json")]))
+            entries.sort()
+            for _, base in entries:
+                if self.size <= self.max_bytes:
+                    break
+                for path in [base + ".body", base + ".json"]:
+                    try:
+                        self.size -= os.path.getsize(path)
+                        os.remove(path)
+                    except OSError:
+                        pass
+                self.evictions += 1
+
+    def get(self, url, fetch=None, headers=None, timeout=None, ttl=None):
+        """
+        GETs a URL through the cache
+
+        Parameters
+        ----------
+        url : str
+        fetch : callable, optional
+            Called as fetch(url, headers=..., timeout=...) on misses,
+            defaults to requests.get
+        headers : dict, optional
+        timeout : float or tuple, optional
+        ttl : float, optional
+            Overrides the TTL configured for the URL
+
+        Returns
+        -------
+        requests.Response or CachedResponse
+        """
+        fetch = fetch or requests.get
+        ttl = self.ttl_for(url) if ttl is None else ttl
+        if ttl <= 0:
+            return fetch(url, headers=headers, timeout=timeout)
+
+        meta, content = self._load(url)
+        if meta is not None and time.time() - meta["stored"] < ttl:
+            with self.lock:
+                self.hits += 1
+            self._touch(url)
+            return CachedResponse(
+                meta["url"], meta["status_code"], meta["headers"], content
+            )
+
+        request_headers = dict(headers or {})
+        if meta is not None:
+            if "ETag" in meta["headers"]:
+                request_headers["If-None-Match"] = meta["headers"]["ETag"]
+            if "Last-Modified" in meta["headers"]:
+                request_headers["If-Modified-Since"] = meta["headers"]["Last-Modified"]
+
+        response = fetch(url, headers=request_headers, timeout=timeout)
+
+        if response.status_code == 304 and meta is not None:
+            with self.lock:
+                self.revalidations += 1
+            response.headers.update(meta["headers"])
+            response.status_code = meta["status_code"]
+            meta = self._store(url, response, content=content)
+            return CachedResponse(
+                meta["url"], meta["status_code"], meta["headers"], content
+            )
+
+        with self.lock:
+            self.misses += 1
+        if response.ok:
+            self._store(url, response)
+        return response
+
+    def stats(self):
+        """
+        Returns hit/miss counters and the current size of the cache
+        """
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "revalidations": self.revalidations,
+                "evictions": self.evictions,
+                "size_bytes": self.size,
+            }
+
+
+def get_default_cache():
+    """
+    Returns the cache shared by all extractors, creating it on first use
+    """
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache()
+        return _default_cache
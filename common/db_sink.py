@@ -0,0 +1,184 @@
+# Bulk database sinks for the extracted data
+
+import os
+import sys
+import time
+import sqlite3
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+from abc import ABC, abstractmethod
+
+
+class Sink(ABC):
+    """
+    Destination for extracted DataFrames
+    """
+
+    @abstractmethod
+    def write(self, df):
+        """
+        Writes the rows of a DataFrame
+        """
+
+    def close(self):
+        pass
+
+
+def _sqlite_type(dtype):
+    if pd.api.types.is_integer_dtype(dtype) or pd.api.types.is_bool_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    return "TEXT"
+
+
+def _quote(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+class SQLiteSink(Sink):
+    """
+    Bulk-upserts DataFrames into a SQLite table
+
+    Rows are sent with executemany in one transaction per `batch_size`
+    rows. Rows whose key already exists are updated in place, so writing
+    the same data twice is idempotent.
+
+    Parameters
+    ----------
+    path : str
+        SQLite database file
+    table : str
+    key_columns : tuple, optional
+        Columns of the primary key
+    batch_size : int, optional
+        Rows per transaction
+    """
+
+    def __init__(self, path, table, key_columns=("ticker", "date"), batch_size=50000):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.table = table
+        self.key_columns = list(key_columns)
+        self.batch_size = batch_size
+
+        self.lock = threading.Lock()
+        self.rows_written = 0
+        self.seconds = 0.0
+
+    def _create_table(self, df):
+        columns = ", ".join(
+            f"{_quote(column)} {_sqlite_type(dtype)}" for column, dtype in df.dtypes.items()
+        )
+        keys = ", ".join(_quote(column) for column in self.key_columns)
+        self.connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {_quote(self.table)} "
+            f"({columns}, PRIMARY KEY ({keys}))"
+        )
+
+    def write(self, df):
+        """
+        Upserts the rows of a DataFrame
+
+        Parameters
+        ----------
+        df : DataFrame
+            Must contain the key columns
+        """
+        if df.empty:
+            return
+        columns = list(df.columns)
+        updates = [column for column in columns if column not in self.key_columns]
+        sql = (
+            f"INSERT INTO {_quote(self.table)} "
+            f"({', '.join(_quote(column) for column in columns)}) "
+            f"VALUES ({', '.join('?' for _ in columns)}) "
+            f"ON CONFLICT ({', '.join(_quote(column) for column in self.key_columns)}) "
+        )
+        if updates:
+            sql += "DO UPDATE SET " + ", ".join(
+                f"{_quote(column)} = excluded.{_quote(column)}" for column in updates
+            )
+        else:
+            sql += "DO NOTHING"
+
+        start = time.perf_counter()
+        with self.lock:
+            self._create_table(df)
+            for batch_start in range(0, len(df), self.batch_size):
+                batch = df.iloc[batch_start : batch_start + self.batch_size]
+                with self.connection:
+                    self.connection.executemany(
+                        sql, batch.itertuples(index=False, name=None)
+                    )
+            self.rows_written += len(df)
+            self.seconds += time.perf_counter() - start
+
+    def stats(self):
+        """
+        Returns the rows written and the write throughput
+        """
+        with self.lock:
+            return {
+                "rows_written": self.rows_written,
+                "seconds": self.seconds,
+                "rows_per_sec": self.rows_written / self.seconds if self.seconds else 0.0,
+            }
+
+    def close(self):
+        self.connection.close()
+
+
+def benchmark(n_rows, batch_sizes=(1000, 10000, 100000)):
+    """
+    Writes (and then re-writes, as upserts) a synthetic EOD frame
+    into a temporary SQLite file with several batch sizes
+
+    Returns
+    -------
+    list
+        Rows per second of the insert and upsert passes per batch size
+    """
+    n_tickers = max(1, n_rows // 5000)
+    df = pd.DataFrame(
+        {
+            "ticker": np.repeat([f"T{i}" for i in range(n_tickers)], 5000)[:n_rows],
+            "date": np.tile(
+                pd.bdate_range("2000-01-03", periods=5000).strftime("%Y-%m-%d"),
+                n_tickers,
+            )[:n_rows],
+            "open": np.random.rand(n_rows),
+            "high": np.random.rand(n_rows),
+            "low": np.random.rand(n_rows),
+            "close": np.random.rand(n_rows),
+            "volume": np.random.randint(0, 10**7, n_rows),
+        }
+    )
+
+    results = []
+    for batch_size in batch_sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            sink = SQLiteSink(os.path.join(folder, "bench.db"), "eod", batch_size=batch_size)
+            sink.write(df)
+            insert_seconds = sink.stats()["seconds"]
+            sink.write(df)
+            upsert_seconds = sink.stats()["seconds"] - insert_seconds
+            sink.close()
+        results.append(
+            {
+                "batch_size": batch_size,
+                "insert_rows_per_sec": len(df) / insert_seconds,
+                "upsert_rows_per_sec": len(df) / upsert_seconds,
+            }
+        )
+    return results
+
+
+if __name__ == "__main__":
+    # Usage: python -m common.db_sink [n_rows]
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    for result in benchmark(n_rows):
+        print(result)
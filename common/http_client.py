@@ -0,0 +1,136 @@
+# Pooled HTTP client shared by the extractors
+
+import time
+import threading
+import requests
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+
+# Local imports
+from common.retry import RetryPolicy
+from common.cache import get_default_cache
+from common.instrumentation import LatencyHistogram, get_instrumentation
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+class HttpClient:
+    """
+    HTTP client with a pooled keep-alive Session, compression,
+    default timeouts and per-host latency histograms
+
+    Non-streamed GETs go through the response cache when one is set.
+
+    Parameters
+    ----------
+    pool_size : int, optional
+        Keep-alive connections kept per host
+    timeout : float or tuple, optional
+        Default (connect, read) timeout in seconds
+    cache : ResponseCache, optional
+        Cache for non-streamed GETs, None disables caching
+    rate_limiter : TokenBucket, optional
+        Limiter every request sent over the network waits on
+    retry : RetryPolicy, optional
+        Policy for failed requests, None disables retries
+    """
+
+    def __init__(
+        self, pool_size=20, timeout=(5, 60), cache=None, rate_limiter=None, retry=None
+    ):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
+
+        self.timeout = timeout
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.retry = retry
+
+        self.lock = threading.Lock()
+        self.latencies = {}
+
+    def get(self, url, headers=None, stream=False, timeout=None, ttl=None):
+        """
+        GETs a URL
+
+        Parameters
+        ----------
+        url : str
+        headers : dict, optional
+            Extra headers for this request
+        stream : bool, optional
+            Stream the body (never cached)
+        timeout : float or tuple, optional
+            Overrides the default timeout
+        ttl : float, optional
+            Overrides the cache TTL for this URL, 0 bypasses the cache
+
+        Returns
+        -------
+        requests.Response or CachedResponse
+        """
+        timeout = timeout or self.timeout
+        if self.cache is not None and not stream:
+            return self.cache.get(
+                url, fetch=self.send, headers=headers, timeout=timeout, ttl=ttl
+            )
+        return self.send(url, headers=headers, stream=stream, timeout=timeout)
+
+    def send(self, url, headers=None, stream=False, timeout=None):
+        """
+        GETs a URL over the network, bypassing the cache
+        """
+        host = urlsplit(url).netloc
+
+        def attempt():
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            start = time.perf_counter()
+            response = self.session.get(
+                url, headers=headers, stream=stream, timeout=timeout or self.timeout
+            )
+            seconds = time.perf_counter() - start
+            self._observe(host, seconds)
+            instrumentation = get_instrumentation()
+            instrumentation.observe("http_fetch", seconds)
+            if not stream:
+                instrumentation.add_bytes("http_fetch", len(response.content))
+            return response
+
+        if self.retry is None:
+            return attempt()
+        return self.retry.call(attempt, host=host)
+
+    def _observe(self, host, seconds):
+        with self.lock:
+            if host not in self.latencies:
+                self.latencies[host] = LatencyHistogram()
+            self.latencies[host].observe(seconds)
+
+    def latency_stats(self):
+        """
+        Returns the latency histogram of every host
+        """
+        with self.lock:
+            return {host: hist.to_dict() for host, hist in self.latencies.items()}
+
+    def close(self):
+        self.session.close()
+
+
+def get_default_client():
+    """
+    Returns the client shared by all extractors, creating it on first use
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = HttpClient(
+                cache=get_default_cache(), retry=RetryPolicy()
+            )
+        return _default_client
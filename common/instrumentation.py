@@ -0,0 +1,240 @@
+# Stage timers and reports shared by the extractors
+
+import os
+import json
+import time
+import heapq
+import bisect
+import pstats
+import cProfile
+import threading
+import functools
+from contextlib import contextmanager
+
+# Upper bounds, in seconds, of the latency histogram buckets
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+
+# Environment variable with the path where profile() dumps its stats
+PROFILE_ENV = "PIPELINE_PROFILE"
+
+_default_instrumentation = None
+_default_instrumentation_lock = threading.Lock()
+
+
+class LatencyHistogram:
+    """
+    Latency histogram with fixed (non-cumulative) buckets
+
+    Parameters
+    ----------
+    buckets : list, optional
+        Sorted upper bounds of the buckets, in seconds
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+    def to_dict(self):
+        labels = [f"<={bucket}" for bucket in self.buckets] + ["+Inf"]
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "buckets": dict(zip(labels, self.counts)),
+        }
+
+
+class Instrumentation:
+    """
+    Per-stage latency histograms, bytes transferred and slowest items
+
+    Stages are timed with the stage() context manager or the timed()
+    decorator, and items (tickers, notas) with observe(..., item=...).
+
+    Parameters
+    ----------
+    buckets : list, optional
+        Upper bounds, in seconds, of the histogram buckets
+    slowest : int, optional
+        Slowest items kept per stage
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS, slowest=10):
+        self.buckets = buckets
+        self.n_slowest = slowest
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.bytes = {}
+        self.slowest = {}
+
+    def observe(self, stage, seconds, item=None):
+        """
+        Records the duration of one run of a stage
+        """
+        with self.lock:
+            if stage not in self.histograms:
+                self.histograms[stage] = LatencyHistogram(self.buckets)
+            self.histograms[stage].observe(seconds)
+            if item is not None:
+                slowest = self.slowest.setdefault(stage, [])
+                if len(slowest) < self.n_slowest:
+                    heapq.heappush(slowest, (seconds, str(item)))
+                else:
+                    heapq.heappushpop(slowest, (seconds, str(item)))
+
+    def add_bytes(self, stage, n_bytes):
+        """
+        Adds to the bytes transferred by a stage
+        """
+        with self.lock:
+            self.bytes[stage] = self.bytes.get(stage, 0) + n_bytes
+
+    @contextmanager
+    def stage(self, stage, item=None):
+        """
+        Times the body of a with block as a run of `stage`
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, item)
+
+    def timed(self, stage):
+        """
+        Decorator that times every call of a function as a run of `stage`
+        """
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.stage(stage):
+                    return function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def report(self):
+        """
+        Returns the histogram, bytes and slowest items of every stage
+        """
+        with self.lock:
+            stages = {}
+            for stage in sorted(set(self.histograms) | set(self.bytes)):
+                entry = {}
+                if stage in self.histograms:
+                    entry.update(self.histograms[stage].to_dict())
+                if stage in self.bytes:
+                    entry["bytes"] = self.bytes[stage]
+                if stage in self.slowest:
+                    entry["slowest"] = [
+                        {"item": item, "seconds": seconds}
+                        for seconds, item in sorted(self.slowest[stage], reverse=True)
+                    ]
+                stages[stage] = entry
+            return stages
+
+    def write_json(self, path):
+        """
+        Writes report() to a JSON file
+        """
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(self.report(), file, indent=2)
+
+    def write_prometheus(self, path, prefix="pipeline"):
+        """
+        Writes the stages in the Prometheus text format, e.g. for the
+        node_exporter textfile collector
+        """
+        seconds = f"{prefix}_stage_seconds"
+        lines = [f"# TYPE {seconds} histogram"]
+        with self.lock:
+            for stage, histogram in sorted(self.histograms.items()):
+                # Prometheus buckets are cumulative
+                cumulative = 0
+                bounds = histogram.buckets + ["+Inf"]
+                for bound, count in zip(bounds, histogram.counts):
+                    cumulative += count
+                    lines.append(
+                        f'{seconds}_bucket{{stage="{stage}",le="{bound}"}} {cumulative}'
+                    )
+                lines.append(f'{seconds}_sum{{stage="{stage}"}} {histogram.total}')
+                lines.append(f'{seconds}_count{{stage="{stage}"}} {histogram.count}')
+
+            lines.append(f"# TYPE {prefix}_stage_bytes_total counter")
+            for stage, n_bytes in sorted(self.bytes.items()):
+                lines.append(
+                    f'{prefix}_stage_bytes_total{{stage="{stage}"}} {n_bytes}'
+                )
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+
+def get_instrumentation():
+    """
+    Returns the instrumentation shared by all extractors, creating it on first use
+    """
+    global _default_instrumentation
+    with _default_instrumentation_lock:
+        if _default_instrumentation is None:
+            _default_instrumentation = Instrumentation()
+        return _default_instrumentation
+
+
+def stage(name, item=None):
+    """
+    Times a with block as a run of a stage of the shared instrumentation
+    """
+    return get_instrumentation().stage(name, item)
+
+
+def timed(name):
+    """
+    Decorator that times a function as a stage of the shared instrumentation
+    """
+    return get_instrumentation().timed(name)
+
+
+def write_reports(name):
+    """
+    Writes the shared instrumentation to <name>.json and <name>.prom
+    """
+    instrumentation = get_instrumentation()
+    instrumentation.write_json(name + ".json")
+    instrumentation.write_prometheus(name + ".prom")
+    print(f"Wrote stage report to {name}.json and {name}.prom")
+
+
+@contextmanager
+def profile(path=None, top=30):
+    """
+    Runs the body of a with block under cProfile when a path is given
+    or the PIPELINE_PROFILE environment variable is set
+
+    The raw stats are dumped to the path (readable with pstats or
+    snakeviz) and the `top` functions by cumulative time are printed.
+    """
+    path = path or os.environ.get(PROFILE_ENV)
+    if not path:
+        yield None
+        return
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(top)
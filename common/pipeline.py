@@ -0,0 +1,89 @@
+# Concurrent stage pipeline connected by bounded queues
+
+import queue
+import threading
+
+
+_DONE = object()
+
+
+def run_pipeline(items, stages, queue_size=8):
+    """
+    Runs items through a sequence of concurrent stages
+
+    Every stage has its own worker threads and reads from a bounded
+    queue filled by the previous stage, so a slow stage applies
+    backpressure instead of letting work pile up in memory.
+
+    Parameters
+    ----------
+    items : iterable
+        Inputs of the first stage
+    stages : list
+        (name, function, workers) tuples. `function` receives an item and
+        returns the item for the next stage, or None to drop it
+    queue_size : int, optional
+        Capacity of the queue in front of every stage
+
+    Returns
+    -------
+    dict
+        Stage name -> list of (item, exception) for the items that failed.
+        An error raised by `items` itself is recorded under the first
+        stage with None as the item
+    """
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    errors = {name: [] for name, _, _ in stages}
+    lock = threading.Lock()
+    remaining = [workers for _, _, workers in stages]
+
+    def feed():
+        try:
+            for item in items:
+                queues[0].put(item)
+        except Exception as e:
+            # Recorded under the first stage, the items already fed still run
+            print(f"Error reading the items of {stages[0][0]}: {e}")
+            with lock:
+                errors[stages[0][0]].append((None, e))
+        finally:
+            for _ in range(stages[0][2]):
+                queues[0].put(_DONE)
+
+    def work(index):
+        name, function, _ = stages[index]
+        is_last = index == len(stages) - 1
+        while True:
+            item = queues[index].get()
+            if item is _DONE:
+                break
+            try:
+                result = function(item)
+            except Exception as e:
+                print(f"Error in {name} for {item}: {e}")
+                with lock:
+                    errors[name].append((item, e))
+                continue
+            if result is not None and not is_last:
+                queues[index + 1].put(result)
+
+        # The last worker of a stage tells every worker of the next one to stop
+        with lock:
+            remaining[index] -= 1
+            finished = remaining[index] == 0
+        if finished and not is_last:
+            for _ in range(stages[index + 1][2]):
+                queues[index + 1].put(_DONE)
+
+    threads = [threading.Thread(target=feed, daemon=True)]
+    for index, (_, _, workers) in enumerate(stages):
+        threads += [
+            threading.Thread(target=work, args=(index,), daemon=True)
+            for _ in range(workers)
+        ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return errors
@@ -0,0 +1,50 @@
+# Rate limiting helpers shared by the extractors
+
+import time
+import threading
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter
+
+    Tokens are refilled continuously at `rate` tokens per second up to
+    `capacity`, so short bursts are allowed while the long-run request
+    rate stays bounded.
+
+    Parameters
+    ----------
+    rate : float
+        Tokens added per second
+    capacity : float, optional
+        Maximum tokens stored (burst size), defaults to `rate`
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def acquire(self, tokens=1):
+        """
+        Blocks until `tokens` tokens are available and consumes them
+        """
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
@@ -0,0 +1,283 @@
+# Retry policy shared by the extractors
+
+import time
+import random
+import threading
+import requests
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+
+# Statuses worth retrying: throttling and transient server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised when a call is rejected because the circuit of its host is open
+    """
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a host after `failure_threshold` consecutive failed calls
+
+    Once open, calls are held back for `reset_timeout` seconds. After that
+    calls are let through again, and a single failure reopens it.
+
+    Parameters
+    ----------
+    failure_threshold : int, optional
+    reset_timeout : float, optional
+    """
+
+    def __init__(self, failure_threshold=25, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def remaining(self):
+        """
+        Seconds until the circuit lets calls through, 0 if it is closed
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return 0.0
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining <= 0:
+                self.opened_at = None
+                self.failures = self.failure_threshold - 1
+                return 0.0
+            return remaining
+
+    def allow(self):
+        return self.remaining() == 0.0
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class RetryBudget:
+    """
+    Caps retries at `min_retries` plus `ratio` of the calls made, so
+    retries can't multiply the load on a struggling server
+
+    Parameters
+    ----------
+    ratio : float, optional
+    min_retries : int, optional
+    """
+
+    def __init__(self, ratio=0.2, min_retries=10):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.calls = 0
+        self.retries = 0
+        self.lock = threading.Lock()
+
+    def record_call(self):
+        with self.lock:
+            self.calls += 1
+
+    def try_retry(self):
+        """
+        Takes a retry from the budget, returns False if it is spent
+        """
+        with self.lock:
+            if self.retries >= self.min_retries + self.ratio * self.calls:
+                return False
+            self.retries += 1
+            return True
+
+
+class RetryPolicy:
+    """
+    Retries calls with exponential backoff and full jitter
+
+    A call is retried when it raises one of `retry_on` or returns a
+    response whose status is in `retry_statuses`, honoring Retry-After.
+    Retries are limited by `max_attempts` per call and by a budget shared
+    by all calls. Every host gets its own circuit breaker, which counts
+    calls that gave up (not attempts). While a circuit is open, calls wait
+    for it to close, or raise CircuitOpenError with `fail_fast`.
+
+    Parameters
+    ----------
+    max_attempts : int, optional
+        Attempts per call, including the first one
+    base_delay : float, optional
+        Backoff of the first retry, doubled on every attempt
+    max_delay : float, optional
+        Maximum backoff, also caps Retry-After
+    retry_statuses : tuple, optional
+    retry_on : tuple, optional
+        Exceptions that are retried
+    budget : RetryBudget, optional
+    failure_threshold : int, optional
+        Consecutive failed calls that open a host's circuit
+    reset_timeout : float, optional
+        Seconds a circuit stays open
+    fail_fast : bool, optional
+        Raise CircuitOpenError instead of waiting for an open circuit
+    """
+
+    def __init__(
+        self,
+        max_attempts=5,
+        base_delay=0.5,
+        max_delay=60,
+        retry_statuses=RETRY_STATUSES,
+        retry_on=(requests.RequestException, OSError),
+        budget=None,
+        failure_threshold=25,
+        reset_timeout=30,
+        fail_fast=False,
+    ):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_statuses = retry_statuses
+        self.retry_on = retry_on
+        self.budget = budget or RetryBudget()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.fail_fast = fail_fast
+
+        self.lock = threading.Lock()
+        self.breakers = {}
+        self.metrics = {
+            "calls": 0,
+            "retries": 0,
+            "giveups": 0,
+            "circuit_rejections": 0,
+            "circuit_waits": 0,
+            "backoff_seconds": 0.0,
+            "circuit_wait_seconds": 0.0,
+        }
+
+    def breaker(self, host):
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout
+                )
+            return self.breakers[host]
+
+    def backoff(self, attempt):
+        """
+        Full-jitter exponential backoff for a given attempt
+        """
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        )
+
+    def retry_after(self, response):
+        """
+        Seconds requested by the Retry-After header, if any
+        """
+        value = response.headers.get("Retry-After")
+        if not value:
+            return None
+        if value.isdigit():
+            return float(value)
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+    def _count(self, metric, value=1):
+        with self.lock:
+            self.metrics[metric] += value
+
+    def wait_for_circuit(self, breaker, host):
+        """
+        Blocks until the circuit of `host` lets calls through
+        """
+        while True:
+            remaining = breaker.remaining()
+            if remaining == 0.0:
+                return
+            if self.fail_fast:
+                self._count("circuit_rejections")
+                raise CircuitOpenError(f"Circuit open for {host}")
+            print(f"Circuit open for {host}, waiting {remaining:.1f}s")
+            self._count("circuit_waits")
+            self._count("circuit_wait_seconds", remaining)
+            time.sleep(remaining)
+
+    def call(self, function, host=None):
+        """
+        Calls `function` until it succeeds or the retries are exhausted
+
+        Parameters
+        ----------
+        function : callable
+            Called without arguments
+        host : str, optional
+            Host whose circuit breaker guards the call
+
+        Returns
+        -------
+        object
+            What `function` returned. A response with a retryable status
+            is returned as is once retries are exhausted
+        """
+        breaker = self.breaker(host) if host else None
+        self.budget.record_call()
+        self._count("calls")
+
+        attempt = 0
+        while True:
+            attempt += 1
+            if breaker is not None:
+                self.wait_for_circuit(breaker, host)
+
+            error, response = None, None
+            try:
+                response = function()
+            except self.retry_on as e:
+                error = e
+            else:
+                if getattr(response, "status_code", None) not in self.retry_statuses:
+                    if breaker is not None:
+                        breaker.record_success()
+                    return response
+
+            if attempt >= self.max_attempts or not self.budget.try_retry():
+                self._count("giveups")
+                if breaker is not None:
+                    breaker.record_failure()
+                if error is not None:
+                    raise error
+                return response
+
+            delay = self.backoff(attempt)
+            if response is not None:
+                retry_after = self.retry_after(response)
+                if retry_after is not None:
+                    delay = min(max(delay, retry_after), self.max_delay)
+                response.close()
+
+            reason = error if error is not None else f"status {response.status_code}"
+            print(f"Retrying {host or 'call'} in {delay:.1f}s ({attempt}): {reason}")
+            self._count("retries")
+            self._count("backoff_seconds", delay)
+            time.sleep(delay)
+
+    def stats(self):
+        """
+        Returns the retry counters and the time spent backing off
+        """
+        with self.lock:
+            return dict(self.metrics)
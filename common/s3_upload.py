@@ -0,0 +1,384 @@
+# Resumable multipart uploads to S3
+
+import os
+import json
+import math
+import base64
+import hashlib
+import tempfile
+import threading
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+
+# Local imports
+from common.retry import RetryPolicy
+
+
+# S3 rejects multipart parts smaller than 5 MB (except the last one)
+MIN_PART_SIZE = 5 * 1024**2
+
+
+class TruncatedRangeError(IOError):
+    """
+    Raised when a Range response doesn't have the requested length
+    """
+
+
+def md5_digest(data):
+    """
+    Returns the hex MD5 of `data` and its base64 form for ContentMD5
+    """
+    digest = hashlib.md5(data)
+    return digest.hexdigest(), base64.b64encode(digest.digest()).decode("ascii")
+
+
+class MultipartUploader:
+    """
+    Streams files to S3 with resumable multipart uploads
+
+    Parts are read from disk as they are sent, so at most
+    `max_concurrency` parts are in memory. Each part is sent with its
+    MD5 so S3 verifies it, and the upload id is kept in a checkpoint
+    file next to the source. If an upload is interrupted, the next call
+    resumes it: parts already in S3 whose ETag matches the local MD5
+    are kept and only missing or corrupt parts are sent again.
+
+    Parameters
+    ----------
+    client : botocore.client.S3
+        S3 client, e.g. boto3.client("s3") or a moto-backed client
+    part_size : int, optional
+        Size of every part but the last, in bytes
+    max_concurrency : int, optional
+        Parts uploaded at the same time
+    """
+
+    def __init__(self, client, part_size=64 * 1024**2, max_concurrency=4):
+        if part_size < MIN_PART_SIZE:
+            raise ValueError(f"part_size must be at least {MIN_PART_SIZE} bytes")
+        self.client = client
+        self.part_size = part_size
+        self.max_concurrency = max_concurrency
+
+    def upload_file(self, path, bucket, key, extra_args=None):
+        """
+        Uploads a local file to S3
+
+        Parameters
+        ----------
+        path : str
+            Local file
+        bucket : str
+        key : str
+        extra_args : dict, optional
+            Extra arguments for put_object / create_multipart_upload,
+            e.g. {"ACL": "public-read"}
+        """
+        extra_args = extra_args or {}
+        size = os.path.getsize(path)
+        if size <= self.part_size:
+            with open(path, "rb") as file:
+                self.client.put_object(Body=file, Bucket=bucket, Key=key, **extra_args)
+            return
+
+        checkpoint_path = path + ".upload.json"
+        state = {
+            "bucket": bucket,
+            "key": key,
+            "size": size,
+            "mtime": os.path.getmtime(path),
+            "part_size": self.part_size,
+        }
+        upload_id = self._resume_id(checkpoint_path, state)
+        uploaded = self.uploaded_parts(bucket, key, upload_id) if upload_id else {}
+        if not upload_id:
+            upload_id = self.client.create_multipart_upload(
+                Bucket=bucket, Key=key, **extra_args
+            )["UploadId"]
+            state["upload_id"] = upload_id
+            with open(checkpoint_path, "w", encoding="utf-8") as file:
+                json.dump(state, file)
+
+        def upload_part(part_number):
+            with open(path, "rb") as file:
+                file.seek((part_number - 1) * self.part_size)
+                data = file.read(self.part_size)
+            return self.upload_part(
+                bucket, key, upload_id, part_number, data, uploaded.get(part_number)
+            )
+
+        part_count = math.ceil(size / self.part_size)
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            parts = list(executor.map(upload_part, range(1, part_count + 1)))
+
+        self.client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+        os.remove(checkpoint_path)
+
+    def upload_part(self, bucket, key, upload_id, part_number, data, etag=None):
+        """
+        Uploads one part, skipping it if `etag` (from an earlier attempt)
+        matches the MD5 of `data`
+
+        Returns
+        -------
+        dict
+            {"PartNumber", "ETag"} entry for complete_multipart_upload
+        """
+        hex_md5, content_md5 = md5_digest(data)
+        if etag is not None and etag.strip('"') == hex_md5:
+            return {"PartNumber": part_number, "ETag": etag}
+
+        response = self.client.upload_part(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=data,
+            ContentMD5=content_md5,
+        )
+        return {"PartNumber": part_number, "ETag": response["ETag"]}
+
+    def uploaded_parts(self, bucket, key, upload_id):
+        """
+        Returns the parts already uploaded, as {part number: ETag}
+        """
+        paginator = self.client.get_paginator("list_parts")
+        parts = {}
+        for page in paginator.paginate(Bucket=bucket, Key=key, UploadId=upload_id):
+            for part in page.get("Parts", []):
+                parts[part["PartNumber"]] = part["ETag"]
+        return parts
+
+    def _resume_id(self, checkpoint_path, state):
+        """
+        Returns the upload id of an interrupted upload of the same
+        file, or None if there is nothing to resume
+        """
+        if not os.path.exists(checkpoint_path):
+            return None
+        with open(checkpoint_path, "r", encoding="utf-8") as file:
+            checkpoint = json.load(file)
+        upload_id = checkpoint.pop("upload_id", None)
+        if checkpoint != state:
+            if upload_id:
+                self.abort(checkpoint["bucket"], checkpoint["key"], upload_id)
+            return None
+        try:
+            self.client.list_parts(
+                Bucket=state["bucket"], Key=state["key"], UploadId=upload_id, MaxParts=1
+            )
+        except ClientError:
+            return None
+        return upload_id
+
+    def abort(self, bucket, key, upload_id):
+        """
+        Aborts a multipart upload, ignoring uploads that no longer exist
+        """
+        try:
+            self.client.abort_multipart_upload(
+                Bucket=bucket, Key=key, UploadId=upload_id
+            )
+        except ClientError:
+            pass
+
+
+class RangedTransfer:
+    """
+    Copies a URL to S3 with one HTTP Range request per multipart part
+
+    Every part is checked against its expected length and uploaded
+    with its MD5, and a failed part is retried on its own. The upload id
+    and the ETag of every finished part are checkpointed, so a restarted
+    transfer only moves the parts that are still missing. Servers that
+    don't support ranges fall back to a single streamed upload.
+
+    Parameters
+    ----------
+    client : HttpClient
+    uploader : MultipartUploader
+        Uploader whose client, part size and concurrency are used
+    checkpoint_dir : str, optional
+        Folder for the checkpoint files
+    retry : RetryPolicy, optional
+        Policy for parts whose body came back truncated. HTTP errors are
+        already retried by the client, so by default only
+        TruncatedRangeError is retried here
+    """
+
+    def __init__(
+        self,
+        client,
+        uploader,
+        checkpoint_dir=os.path.join(tempfile.gettempdir(), "ranged-transfers"),
+        retry=None,
+    ):
+        self.client = client
+        self.uploader = uploader
+        self.checkpoint_dir = checkpoint_dir
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        self.retry = retry or RetryPolicy(retry_on=(TruncatedRangeError,))
+
+    def content_length(self, url):
+        """
+        Returns the size of the resource if the server supports
+        Range requests, otherwise None
+        """
+        response = self.client.send(url, headers={"Range": "bytes=0-0"}, stream=True)
+        response.close()
+        content_range = response.headers.get("Content-Range", "")
+        if response.status_code != 206 or "/" not in content_range:
+            return None
+        total = content_range.rsplit("/", 1)[1]
+        return int(total) if total.isdigit() else None
+
+    def download_range(self, url, start, stop):
+        """
+        Downloads bytes [start, stop) of a URL, failing on truncated bodies
+        """
+        response = self.client.send(url, headers={"Range": f"bytes={start}-{stop - 1}"})
+        response.raise_for_status()
+        if response.status_code != 206 or len(response.content) != stop - start:
+            raise TruncatedRangeError(
+                f"Expected {stop - start} bytes from {url}, got {len(response.content)}"
+            )
+        return response.content
+
+    def transfer(self, url, bucket, key, extra_args=None, callback=None):
+        """
+        Copies a URL to S3
+
+        Parameters
+        ----------
+        url : str
+        bucket : str
+        key : str
+        extra_args : dict, optional
+            Extra arguments for the upload, e.g. {"ACL": "public-read"}
+        callback : callable, optional
+            Called with the number of bytes of every uploaded part
+        """
+        extra_args = extra_args or {}
+        s3_client = self.uploader.client
+        size = self.content_length(url)
+
+        if size is None:
+            response = self.client.send(url, stream=True)
+            response.raise_for_status()
+            response.raw.decode_content = True
+            try:
+                s3_client.upload_fileobj(
+                    response.raw, bucket, key, ExtraArgs=extra_args, Callback=callback
+                )
+            finally:
+                response.close()
+            return
+
+        part_size = self.uploader.part_size
+        if size <= part_size:
+            data = self.retry.call(lambda: self.download_range(url, 0, size))
+            _, content_md5 = md5_digest(data)
+            s3_client.put_object(
+                Bucket=bucket, Key=key, Body=data, ContentMD5=content_md5, **extra_args
+            )
+            if callback is not None:
+                callback(size)
+            return
+
+        name = hashlib.sha256(f"{bucket}/{key}".encode("utf-8")).hexdigest()
+        checkpoint_path = os.path.join(self.checkpoint_dir, name + ".json")
+        checkpoint = self._load_checkpoint(
+            checkpoint_path, bucket, key, url, size, part_size
+        )
+        if checkpoint is not None:
+            # Keep only the parts S3 still has with the same ETag
+            try:
+                uploaded = self.uploader.uploaded_parts(
+                    bucket, key, checkpoint["upload_id"]
+                )
+            except ClientError:
+                checkpoint = None
+            else:
+                checkpoint["parts"] = {
+                    number: etag
+                    for number, etag in checkpoint["parts"].items()
+                    if uploaded.get(int(number)) == etag
+                }
+        if checkpoint is None:
+            upload_id = s3_client.create_multipart_upload(
+                Bucket=bucket, Key=key, **extra_args
+            )["UploadId"]
+            checkpoint = {
+                "url": url,
+                "size": size,
+                "part_size": part_size,
+                "upload_id": upload_id,
+                "parts": {},
+            }
+            self._save_checkpoint(checkpoint_path, checkpoint)
+        upload_id = checkpoint["upload_id"]
+        lock = threading.Lock()
+
+        def transfer_part(part_number):
+            if str(part_number) in checkpoint["parts"]:
+                return
+            start = (part_number - 1) * part_size
+            stop = min(start + part_size, size)
+
+            def attempt():
+                data = self.download_range(url, start, stop)
+                return self.uploader.upload_part(
+                    bucket, key, upload_id, part_number, data
+                )
+
+            part = self.retry.call(attempt)
+            with lock:
+                checkpoint["parts"][str(part_number)] = part["ETag"]
+                self._save_checkpoint(checkpoint_path, checkpoint)
+            if callback is not None:
+                callback(stop - start)
+
+        part_count = math.ceil(size / part_size)
+        with ThreadPoolExecutor(max_workers=self.uploader.max_concurrency) as executor:
+            list(executor.map(transfer_part, range(1, part_count + 1)))
+
+        parts = [
+            {"PartNumber": number, "ETag": checkpoint["parts"][str(number)]}
+            for number in range(1, part_count + 1)
+        ]
+        s3_client.complete_multipart_upload(
+            Bucket=bucket,
+            Key=key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+        os.remove(checkpoint_path)
+
+        stored_size = s3_client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+        if stored_size != size:
+            raise IOError(f"{key} has {stored_size} bytes in S3, expected {size}")
+
+    def _load_checkpoint(self, checkpoint_path, bucket, key, url, size, part_size):
+        if not os.path.exists(checkpoint_path):
+            return None
+        with open(checkpoint_path, "r", encoding="utf-8") as file:
+            checkpoint = json.load(file)
+        if (checkpoint["url"], checkpoint["size"], checkpoint["part_size"]) != (
+            url,
+            size,
+            part_size,
+        ):
+            self.uploader.abort(bucket, key, checkpoint["upload_id"])
+            return None
+        return checkpoint
+
+    def _save_checkpoint(self, checkpoint_path, checkpoint):
+        tmp_path = checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(checkpoint, file)
+        os.replace(tmp_path, checkpoint_path)
@@ -3,17 +3,25 @@
 import json
 import time
 import boto3
-import requests
+import threading
 
 # Local imports
 from keys import aws_keys
+from s3_key_index import S3KeyIndex
+from common.pipeline import run_pipeline
+from common.s3_upload import MultipartUploader, RangedTransfer
+from common.http_client import get_default_client
+from common.instrumentation import get_instrumentation, stage
 
 
 class DOFScrapper:
-    def __init__(self, date):
+    def __init__(self, date, client=None, s3_client=None):
         # Date
         self.date = date
 
+        # Pooled HTTP client, caches the JSON endpoints
+        self.client = client or get_default_client()
+
         # APIs for DOF
         self.FICHAS_API = "https://sidofqa.segob.gob.mx/dof/sidof/notas/fecha"
         self.DIARIO_API = (
@@ -27,28 +35,54 @@ class DOFScrapper:
             "https://sidofqa.segob.gob.mx/dof/sidof/documentos/pdf/codDiario"
         )
 
-        # S3
+        # S3 (clients are thread-safe and can be shared between scrappers)
         self.bucket_name = "your-bucket-name"
-        self.aws_session = boto3.Session(
-            aws_access_key_id=aws_keys["ACCESS_KEY"],
-            aws_secret_access_key=aws_keys["SECRET_KEY"],
-        )
-        self.s3 = self.aws_session.resource("s3")
-        self.bucket = self.s3.Bucket(self.bucket_name)
+        if s3_client is None:
+            aws_session = boto3.Session(
+                aws_access_key_id=aws_keys["ACCESS_KEY"],
+                aws_secret_access_key=aws_keys["SECRET_KEY"],
+            )
+            s3_client = aws_session.client("s3")
+        self.s3_client = s3_client
         self.s3_path = f"dof/{self.date}/"
+        self.s3_index = S3KeyIndex(self.s3_client, self.bucket_name, self.s3_path)
+        self.pdf_transfer = RangedTransfer(
+            self.client, MultipartUploader(self.s3_client, part_size=8 * 1024**2)
+        )
 
-    def check_file_in_s3(self, bucket_name, file_name):
+        # Transfer counters
+        self.stats_lock = threading.Lock()
+        self.notes_uploaded = 0
+        self.bytes_uploaded = 0
+
+    def count_bytes(self, n_bytes):
         """
-        Checks if a file exists in S3
+        Callback for S3 transfers, adds to bytes_uploaded
         """
+        with self.stats_lock:
+            self.bytes_uploaded += n_bytes
+        get_instrumentation().add_bytes("s3_upload", n_bytes)
 
-        try:
-            self.s3.head_object(Bucket=bucket_name, Key=file_name)
-            print("File Exists!")
-            return True
-        except Exception as e:
-            print("File {file_name} not found")
-            return False
+    def upload_stream(self, stream, key, extra_args=None):
+        """
+        Uploads a file-like object to the bucket and records its key
+        """
+        with stage("s3_upload"):
+            self.s3_client.upload_fileobj(
+                stream,
+                self.bucket_name,
+                key,
+                ExtraArgs=extra_args,
+                Callback=self.count_bytes,
+            )
+        self.s3_index.add(key)
+
+    def check_file_in_s3(self, file_name):
+        """
+        Checks if a file exists in the bucket, using the
+        index of the date's folder
+        """
+        return file_name in self.s3_index
 
     def get_diario_code(self):
         """
@@ -61,7 +95,9 @@ class DOFScrapper:
         """
         FIRST_ELEMENT = 0
         new_diario_api = self.DIARIO_API.replace("fecha", self.date)
-        response_diario = requests.get(new_diario_api).json()
+        response = self.client.get(new_diario_api)
+        with stage("json_decode"):
+            response_diario = response.json()
         self.diario_dict = {}
 
         if response_diario["response"] == "NOT_FOUND":
@@ -80,142 +116,184 @@ class DOFScrapper:
     def get_notas_codes(self):
         """
         Getting response from notas API for each diario in diarios_dicts
+
+        Failed requests are retried by the client's retry policy
         """
-        if "codDiario_vespertino" in self.diario_dict.keys():
-            cod_diario_vesp = self.diario_dict["codDiario_vespertino"]
-            success = False
-            while not success:
-                try:
-                    new_notas_diario_api = self.NOTAS_DIARIO_API.replace(
-                        "codDiario", str(cod_diario_vesp)
-                    )
-                    response_notas_diario = requests.get(new_notas_diario_api).json()
-                    success = True
-                    self.diario_dict["notas_vesp"] = response_notas_diario["Notas"]
-                    print(f"Success for {self.diario_dict['fecha']} - notas vespertino")
-                except Exception as err:
-                    print(err)
-                    print(f"Error for {self.diario_dict['fecha']} - notas vespertino")
-                    time.sleep(3)
-                    continue
-
-        if "codDiario_matutino" in self.diario_dict.keys():
-            success = False
-            cod_diario_mat = self.diario_dict["codDiario_matutino"]
-            while not success:
-                try:
-                    new_notas_diario_api = self.NOTAS_DIARIO_API.replace(
-                        "codDiario", str(cod_diario_mat)
-                    )
-                    response_notas_diario = requests.get(new_notas_diario_api).json()
-                    success = True
-                    self.diario_dict["notas_mat"] = response_notas_diario["Notas"]
-                    print(f"Success for {self.diario_dict['fecha']} - notas matutino")
-                except Exception as err:
-                    print(err)
-                    print(f"Error for {self.diario_dict['fecha']} - notas matutino")
-                    time.sleep(3)
-                    continue
-
-    def upload_notas_docs(self):
+        editions = [
+            ("codDiario_vespertino", "notas_vesp", "vespertino"),
+            ("codDiario_matutino", "notas_mat", "matutino"),
+        ]
+        for diario_key, notas_key, edition in editions:
+            if diario_key in self.diario_dict:
+                new_notas_diario_api = self.NOTAS_DIARIO_API.replace(
+                    "codDiario", str(self.diario_dict[diario_key])
+                )
+                response = self.client.get(new_notas_diario_api)
+                response.raise_for_status()
+                with stage("json_decode"):
+                    self.diario_dict[notas_key] = response.json()["Notas"]
+                print(f"Success for {self.diario_dict['fecha']} - notas {edition}")
+
+    def iter_notas_codes(self):
+        """
+        Yields the code of every nota (vespertina, then matutina)
+        """
+        for notas_key in ["notas_vesp", "notas_mat"]:
+            for nota_dict in self.diario_dict.get(notas_key, []):
+                yield nota_dict["codNota"]
+
+    def open_nota(self, nota_code):
+        """
+        Requests the word document of a nota as a stream
+
+        The raw stream is decoded, so a gzip-encoded response is
+        uploaded as the document itself in both upload modes.
+        """
+        nota_api = self.DOC_NOTA_API.replace("codNota", str(nota_code))
+        r = self.client.get(nota_api, stream=True)
+        r.raise_for_status()
+        r.raw.decode_content = True
+        return r
+
+    def upload_notas_docs(self, pipelined=False, **pipeline_kwargs):
         """
         Downloads the word document from the requested
         note and uploads it to the S3 bucket
+
+        Parameters
+        ----------
+        pipelined : bool, optional
+            Process notas concurrently with upload_notas_docs_pipelined,
+            which receives the remaining keyword arguments
+
+        Returns
+        -------
+        dict
+            Failed notas by stage, a failed nota doesn't stop the rest
         """
-        if "notas_vesp" in self.diario_dict:
-            for nota_dict in self.diario_dict["notas_vesp"]:
-                nota_code = nota_dict["codNota"]
-                key = self.s3_path + f"nota_{nota_code}.doc"
-                if not self.check_file_in_s3("dive-cmm", key):
-                    nota_api = self.DOC_NOTA_API.replace("codNota", str(nota_code))
-                    print(f"Downloading nota {nota_code}")
-                    success = False
-                    while not success:
-                        try:
-                            r = requests.get(nota_api, stream=True)
-                            success = True
-                        except Exception as err:
-                            print(err)
-                            print(f"Error for {nota_code}")
-                            time.sleep(3)
-                            continue
-                    print(f"Uploading nota {nota_code}")
-                    # Upload to S3
-                    self.bucket.upload_fileobj(
-                        r.raw, key, ExtraArgs={"ACL": "public-read"}
-                    )
-                    time.sleep(0.5)
-                else:
-                    print(f"File {key} already exists")
-
-        if "notas_mat" in self.diario_dict:
-            for nota_dict in self.diario_dict["notas_mat"]:
-                nota_code = nota_dict["codNota"]
-                key = self.s3_path + f"nota_{nota_code}.doc"
-                if not self.check_file_in_s3("dive-cmm", key):
-                    nota_api = self.DOC_NOTA_API.replace("codNota", str(nota_code))
+        if pipelined:
+            return self.upload_notas_docs_pipelined(**pipeline_kwargs)
+
+        errors = {"download": [], "upload": []}
+        for nota_code in self.iter_notas_codes():
+            key = self.s3_path + f"nota_{nota_code}.doc"
+            if not self.check_file_in_s3(key):
+                with stage("note", item=nota_code):
                     print(f"Downloading nota {nota_code}")
-                    r = requests.get(nota_api, stream=True)
-                    success = False
-                    while not success:
-                        try:
-                            r = requests.get(nota_api, stream=True)
-                            success = True
-                        except Exception as err:
-                            print(err)
-                            print(f"Error for {nota_code}")
-                            time.sleep(3)
-                            continue
+                    try:
+                        r = self.open_nota(nota_code)
+                    except Exception as e:
+                        print(f"Error in download for {nota_code}: {e}")
+                        errors["download"].append((nota_code, e))
+                        continue
                     print(f"Uploading nota {nota_code}")
                     # Upload to S3
-                    self.bucket.upload_fileobj(
-                        r.raw, key, ExtraArgs={"ACL": "public-read"}
-                    )
-                    time.sleep(0.5)
-                else:
-                    print(f"File {key} already exists")
+                    try:
+                        self.upload_stream(
+                            r.raw, key, extra_args={"ACL": "public-read"}
+                        )
+                    except Exception as e:
+                        print(f"Error in upload for {nota_code}: {e}")
+                        errors["upload"].append((nota_code, e))
+                        continue
+                    finally:
+                        r.close()
+                with self.stats_lock:
+                    self.notes_uploaded += 1
+                time.sleep(0.5)
+            else:
+                print(f"File {key} already exists")
+        return errors
+
+    def upload_notas_docs_pipelined(
+        self, check_workers=8, download_workers=4, upload_workers=4, queue_size=8
+    ):
+        """
+        Runs the existence checks, downloads and uploads of the notas
+        as concurrent stages connected by bounded queues
+
+        Each document is streamed from the HTTP response straight
+        into the S3 upload, without touching disk.
+
+        Parameters
+        ----------
+        check_workers : int, optional
+            Concurrent existence checks
+        download_workers : int, optional
+            Concurrent downloads
+        upload_workers : int, optional
+            Concurrent uploads
+        queue_size : int, optional
+            Capacity of the queue in front of every stage
+
+        Returns
+        -------
+        dict
+            Failed notas by stage
+        """
+
+        def check(nota_code):
+            key = self.s3_path + f"nota_{nota_code}.doc"
+            if self.check_file_in_s3(key):
+                print(f"File {key} already exists")
+                return None
+            return nota_code, key
+
+        def download(item):
+            nota_code, key = item
+            print(f"Downloading nota {nota_code}")
+            start = time.perf_counter()
+            r = self.open_nota(nota_code)
+            return nota_code, key, r, start
+
+        def upload(item):
+            nota_code, key, r, start = item
+            print(f"Uploading nota {nota_code}")
+            try:
+                self.upload_stream(r.raw, key, extra_args={"ACL": "public-read"})
+                with self.stats_lock:
+                    self.notes_uploaded += 1
+            finally:
+                r.close()
+            # From the start of the download to the end of the upload
+            get_instrumentation().observe(
+                "note", time.perf_counter() - start, item=nota_code
+            )
+
+        return run_pipeline(
+            self.iter_notas_codes(),
+            [
+                ("check", check, check_workers),
+                ("download", download, download_workers),
+                ("upload", upload, upload_workers),
+            ],
+            queue_size=queue_size,
+        )
 
     def upload_diario_pdf(self):
         """
         Uploads the whole diario as pdf
+
+        PDFs are copied with ranged downloads fed into multipart
+        uploads, so an interrupted transfer resumes from the missing
+        parts and a pdf already in the bucket is skipped.
         """
-        if "codDiario_vespertino" in self.diario_dict:
-            diario_code = self.diario_dict["codDiario_vespertino"]
-            pdf_api = self.PDF_DIARIO_API.replace("codDiario", str(diario_code))
-            print(f"Downloading diario pdf {diario_code}")
-            success = False
-            while not success:
-                try:
-                    r = requests.get(pdf_api, stream=True)
-                    success = True
-                except Exception as err:
-                    print(err)
-                    print(f"Error for {diario_code}")
-                    time.sleep(3)
-                    continue
-            print(f"Uploading diario {diario_code}")
-            # Upload to S3
+        for diario_key in ["codDiario_vespertino", "codDiario_matutino"]:
+            if diario_key not in self.diario_dict:
+                continue
+            diario_code = self.diario_dict[diario_key]
             key = self.s3_path + f"diario_{diario_code}.pdf"
-            self.bucket.upload_fileobj(r.raw, key)
+            if self.check_file_in_s3(key):
+                print(f"File {key} already exists")
+                continue
 
-        if "codDiario_matutino" in self.diario_dict:
-            diario_code = self.diario_dict["codDiario_matutino"]
             pdf_api = self.PDF_DIARIO_API.replace("codDiario", str(diario_code))
-            print(f"Downloading diario {diario_code}")
-            success = False
-            while not success:
-                try:
-                    r = requests.get(pdf_api, stream=True)
-                    success = True
-                except Exception as err:
-                    print(err)
-                    print(f"Error for {diario_code}")
-                    time.sleep(3)
-                    continue
-            print(f"Uploading diario {diario_code}")
-            # Upload to S3
-            key = self.s3_path + f"diario_{diario_code}.pdf"
-            self.bucket.upload_fileobj(r.raw, key)
+            print(f"Transferring diario pdf {diario_code}")
+            with stage("pdf_transfer", item=diario_code):
+                self.pdf_transfer.transfer(
+                    pdf_api, self.bucket_name, key, callback=self.count_bytes
+                )
+            self.s3_index.add(key)
 
     def upload_diario_json(self):
         """
@@ -223,5 +301,8 @@ class DOFScrapper:
         """
         if self.diario_dict:
             key = self.s3_path + f"diario_{self.date}.json"
-            self.bucket.put_object(Key=key, Body=json.dumps(self.diario_dict))
+            body = json.dumps(self.diario_dict).encode("utf-8")
+            self.s3_client.put_object(Bucket=self.bucket_name, Key=key, Body=body)
+            self.s3_index.add(key)
+            self.count_bytes(len(body))
             print(f"Uploaded diario {self.date} as json")
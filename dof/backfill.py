@@ -0,0 +1,172 @@
+# Backfills the DOF for a range of dates
+
+import os
+import sys
+import json
+import time
+import boto3
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Local imports
+from keys import aws_keys
+from DOFScrapper import DOFScrapper
+from common.cache import get_default_cache
+from common.http_client import HttpClient
+from common.retry import RetryPolicy
+from common.instrumentation import profile, write_reports
+from common.rate_limit import TokenBucket
+
+
+DATE_FORMAT = "%d-%m-%Y"
+
+
+class DOFBackfill:
+    """
+    Scrapes every date in a range, processing several dates at once
+
+    All dates share one pooled HTTP client, throttled by a global rate
+    limit, and one S3 client. Finished dates are written to a checkpoint
+    file so an interrupted backfill resumes where it stopped.
+
+    Parameters
+    ----------
+    start_date : str
+        First date, in format dd-mm-yyyy
+    end_date : str
+        Last date (inclusive), in format dd-mm-yyyy
+    checkpoint_path : str, optional
+        JSON file with the dates already processed
+    max_workers : int, optional
+        Dates processed at the same time
+    requests_per_second : float, optional
+        Global limit on requests to the DOF API
+    pipelined : bool, optional
+        Upload the notas of every date with the pipelined mode
+    """
+
+    def __init__(
+        self,
+        start_date,
+        end_date,
+        checkpoint_path="dof_backfill.json",
+        max_workers=4,
+        requests_per_second=5,
+        pipelined=True,
+    ):
+        start = datetime.strptime(start_date, DATE_FORMAT)
+        end = datetime.strptime(end_date, DATE_FORMAT)
+        self.dates = [
+            (start + timedelta(days=days)).strftime(DATE_FORMAT)
+            for days in range((end - start).days + 1)
+        ]
+
+        self.max_workers = max_workers
+        self.pipelined = pipelined
+        self.client = HttpClient(
+            cache=get_default_cache(),
+            rate_limiter=TokenBucket(requests_per_second),
+            retry=RetryPolicy(),
+        )
+        aws_session = boto3.Session(
+            aws_access_key_id=aws_keys["ACCESS_KEY"],
+            aws_secret_access_key=aws_keys["SECRET_KEY"],
+        )
+        self.s3_client = aws_session.client("s3")
+
+        self.checkpoint_path = checkpoint_path
+        self.lock = threading.Lock()
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, "r", encoding="utf-8") as file:
+                self.completed = set(json.load(file)["completed"])
+        else:
+            self.completed = set()
+
+    def save_checkpoint(self):
+        """
+        Writes the dates already processed to the checkpoint file
+        """
+        with self.lock:
+            tmp_path = self.checkpoint_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump({"completed": sorted(self.completed)}, file)
+            os.replace(tmp_path, self.checkpoint_path)
+
+    def scrape_date(self, date):
+        """
+        Uploads the notas, pdfs and json of a single date
+
+        Returns
+        -------
+        tuple
+            Notas uploaded and bytes uploaded
+        """
+        scrapper = DOFScrapper(date, client=self.client, s3_client=self.s3_client)
+        scrapper.get_diario_code()
+        if scrapper.diario_dict:
+            scrapper.get_notas_codes()
+            errors = scrapper.upload_notas_docs(pipelined=self.pipelined)
+            scrapper.upload_diario_pdf()
+            scrapper.upload_diario_json()
+            # Leave the date out of the checkpoint so a rerun retries it
+            if any(errors.values()):
+                raise RuntimeError(f"{sum(map(len, errors.values()))} notas failed")
+        return scrapper.notes_uploaded, scrapper.bytes_uploaded
+
+    def run(self):
+        """
+        Runs the backfill over the dates that are not in the checkpoint
+
+        Returns
+        -------
+        dict
+            Dates processed, notas and MB uploaded, and throughput
+        """
+        pending = [date for date in self.dates if date not in self.completed]
+        print(f"Backfilling {len(pending)} of {len(self.dates)} dates")
+
+        notes, n_bytes, failed = 0, 0, []
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.scrape_date, date): date for date in pending}
+            for future in as_completed(futures):
+                date = futures[future]
+                try:
+                    date_notes, date_bytes = future.result()
+                except Exception as e:
+                    print(f"Error for {date}: {e}")
+                    failed.append(date)
+                    continue
+
+                notes += date_notes
+                n_bytes += date_bytes
+                with self.lock:
+                    self.completed.add(date)
+                self.save_checkpoint()
+
+                elapsed = time.perf_counter() - start
+                print(
+                    f"Finished {date}: {notes / elapsed:.2f} notas/s, "
+                    f"{n_bytes / 1e6 / elapsed:.2f} MB/s"
+                )
+
+        elapsed = time.perf_counter() - start
+        report = {
+            "dates": len(pending) - len(failed),
+            "failed": failed,
+            "notes": notes,
+            "mb": n_bytes / 1e6,
+            "seconds": elapsed,
+            "notes_per_sec": notes / elapsed if elapsed else 0.0,
+            "mb_per_sec": n_bytes / 1e6 / elapsed if elapsed else 0.0,
+        }
+        print(report)
+        return report
+
+
+if __name__ == "__main__":
+    # Usage: python backfill.py dd-mm-yyyy dd-mm-yyyy
+    with profile():
+        DOFBackfill(sys.argv[1], sys.argv[2]).run()
+    write_reports("dof_backfill_stages")
@@ -0,0 +1,54 @@
+# In-memory index of the keys stored under an S3 prefix
+
+import threading
+
+
+class S3KeyIndex:
+    """
+    Set of the keys under a prefix, built from a single paginated
+    listing and updated as uploads finish, so existence checks don't
+    need a request per key
+
+    Parameters
+    ----------
+    client : botocore.client.S3
+    bucket_name : str
+    prefix : str
+    """
+
+    def __init__(self, client, bucket_name, prefix):
+        self.client = client
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.keys = None
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+
+    def refresh(self):
+        """
+        Lists the prefix and replaces the cached keys
+        """
+        keys = set()
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=self.prefix):
+            for obj in page.get("Contents", []):
+                keys.add(obj["Key"])
+        with self.lock:
+            self.keys = keys
+        print(f"Listed {len(keys)} files in {self.prefix}")
+
+    def add(self, key):
+        """
+        Records a key that was just uploaded
+        """
+        with self.lock:
+            if self.keys is not None:
+                self.keys.add(key)
+
+    def __contains__(self, key):
+        # Concurrent first checks wait for a single listing
+        with self.refresh_lock:
+            if self.keys is None:
+                self.refresh()
+        with self.lock:
+            return key in self.keys
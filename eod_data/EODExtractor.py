@@ -1,14 +1,38 @@
-import time
-import requests
+import os
+import tempfile
+import numpy as np
 import pandas as pd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 # Local imports
 from keys import eod_keys
+from eod_store import EODStore
+from bar_store import BarStore
+from eod_collector import EODCollector, parse_records
+from eod_columnar import dates_to_int32, write_exchange_file
+from trading_calendar import TradingCalendar
+from symbol_universe import SymbolUniverse
+from common.retry import RetryPolicy
+from common.cache import get_default_cache
+from common.http_client import HttpClient, get_default_client
+from common.instrumentation import stage
+from common.rate_limit import TokenBucket
 
 
 # EOD Price Extractor - Extracts EOD prices from EOD API
 class EODExtractor:
-    def __init__(self, ticker_path, output_path):
+    def __init__(
+        self,
+        ticker_path,
+        output_path,
+        max_workers=8,
+        requests_per_second=10,
+        store_path=None,
+        client=None,
+        calendar=None,
+        universe_path=None,
+    ):
 
         # Global variables
 
@@ -22,14 +46,46 @@ class EODExtractor:
         # Output path
         self.output_path = output_path
 
+        # Concurrency for get_eod_data: number of tickers fetched at once
+        # and a token bucket shared by all workers to respect API limits
+        self.max_workers = max_workers
+        self.rate_limiter = (
+            TokenBucket(requests_per_second) if requests_per_second else None
+        )
+
+        # Errors from the last get_eod_data run, keyed by ticker
+        self.errors = {}
+
+        # Pooled, cached HTTP client. Every request it sends over the
+        # network, retries included, waits on the rate limiter
+        if client is None:
+            client = HttpClient(
+                cache=get_default_cache(),
+                rate_limiter=self.rate_limiter,
+                retry=RetryPolicy(),
+            )
+        elif client.rate_limiter is None:
+            client.rate_limiter = self.rate_limiter
+        self.client = client
+
+        # Local store for incremental syncs (None fetches full history)
+        self.store = EODStore(store_path) if store_path else None
+
         self.token = eod_keys["token"]
         self.tickers_url = f"https://eodhistoricaldata.com/api/exchange-symbol-list/EXCHANGE_CODE?api_token={self.token}&fmt=json"
         self.eod_url = f"https://eodhistoricaldata.com/api/eod/TICKER.COUNTRY?api_token={self.token}&period=d&fmt=json"
         self.adjusted_eod_url = f"https://eodhistoricaldata.com/api/technical/TICKER.COUNTRY?api_token={self.token}&fmt=json&function=splitadjusted"
+        self.holidays_url = f"https://eodhistoricaldata.com/api/exchange-details/US?api_token={self.token}&fmt=json&from=2000-01-01"
 
         self.exchanges_of_interest = ["NYSE", "NYSE ARCA", "NASDAQ", "OTC"]
         self.types = ["Common Stock", "ETF"]
 
+        # Deduplicated index of the active and delisted US symbols
+        self.universe = SymbolUniverse(
+            universe_path
+            or os.path.join(tempfile.gettempdir(), "us-symbol-universe.json")
+        )
+
         self.missing_tickers_dict = {
             "CTRP": "NASDAQ",
             "DPK": "NYSE ARCA",
@@ -51,6 +107,10 @@ class EODExtractor:
             "AVGOP": "NASDAQ",
         }
 
+        # Tickers and exchanges that are placed in NYSE
+        self.rare_tickers = ["SVXY", "USMV", "UVXY", "VIXM", "VIXY", "VXX", "VXZ"]
+        self.nyse_exchanges = ["BATS", "NYSE MKT"]
+
         self.columns_map = {
             "ticker_id": "<TICKER>",
             "date": "<DATE>",
@@ -104,35 +164,46 @@ class EODExtractor:
             "2021-09-06",
         ]
 
+        # US holidays (plus the undesired dates above) whose bars are dropped
+        self.calendar = calendar or TradingCalendar(
+            self.holidays_url, extra_holidays=self.undesired_dates, client=self.client
+        )
+
     # List of us symbols
     def get_us_symbols(self):
         """
         Get list of US symbols from EOD API
         by filtering on some conditions
 
-        Parameters
-        ----------
-        token : str
-            API token to use
+        The active and delisted lists are applied to the symbol universe
+        as a diff, and the esignals are resolved against it, keeping the
+        exchanges_of_interest (after normalization) and types
         """
         url = f"https://eodhistoricaldata.com/api/exchange-symbol-list/US?api_token={self.token}&fmt=json"
-        data = requests.get(url).json()
-        df_us = pd.DataFrame(data)
+        data = self.client.get(url).json()
 
         # Getting delisted tickers
         delisted_url = f"https://eodhistoricaldata.com/api/exchange-symbol-list/US?api_token={self.token}&fmt=json&delisted=1"
-        data = requests.get(delisted_url).json()
-        df_delisted = pd.DataFrame(data)
+        delisted_data = self.client.get(delisted_url).json()
+
+        self.universe.refresh(data, delisted_data)
 
-        # Concatenating dataframes
-        df_us = pd.concat([df_us, df_delisted], ignore_index=True).reset_index(
-            drop=True
-        )
         # Filtering data
         esignals = self.tickers_df["esignal"].tolist()
-        df_us = df_us[df_us["Code"].isin(esignals)].reset_index(drop=True)
+        return self.universe.select(
+            esignals,
+            exchanges=self.exchanges_of_interest,
+            types=self.types,
+            normalize=self.normalized_exchange,
+        )
 
-        return df_us
+    def normalized_exchange(self, ticker, exchange):
+        """
+        Exchange of a ticker after normalize_exchanges()
+        """
+        if ticker in self.rare_tickers or exchange in self.nyse_exchanges:
+            return "NYSE"
+        return exchange
 
     def get_tickers_list(exchange, default_url):
         """
@@ -148,11 +219,38 @@ class EODExtractor:
 
         new_url = default_url.replace("EXCHANGE_CODE", exchange)
         new_url = new_url + "&delisted=1"
-        response = requests.get(new_url)
+        response = get_default_client().get(new_url)
         data = response.json()
 
         return data
 
+    def get_eod_json(self, ticker, country, from_date=None, refresh=False):
+        """
+        Gets the split-adjusted bars of a ticker from the API
+
+        Parameters
+        ----------
+        ticker : str
+        country : str
+        from_date : str, optional
+            Only bars on or after this date (YYYY-MM-DD)
+        refresh : bool, optional
+            Bypass the response cache
+
+        Returns
+        -------
+        list
+            JSON records, one per bar
+        """
+        new_url = self.adjusted_eod_url.replace("TICKER", ticker).replace(
+            "COUNTRY", country
+        )
+        if from_date:
+            new_url += f"&from={from_date}"
+        response = self.client.get(new_url, ttl=0 if refresh else None)
+        with stage("json_decode"):
+            return response.json()
+
     def get_eod_df(self, ticker, country):
         """
         Gets JSON from the API and converts
@@ -168,117 +266,495 @@ class EODExtractor:
         DataFrame
             DataFrame with data
         """
-        new_url = self.adjusted_eod_url.replace("TICKER", ticker).replace(
-            "COUNTRY", country
-        )
-        response = requests.get(new_url)
-        json_info = response.json()
+        json_info = self.get_eod_json(ticker, country)
         df = pd.DataFrame(json_info)
         df["ticker"] = ticker
         # Filtering by date
         # df = df[df["date"] >= self.threshold_date].reset_index(drop=True)
         return df
 
-    # Converting dataframe to txt format
-    def exchange_df_to_txt(self, merged_df, exchange, filename):
+    def normalize_exchanges(self, merged_df):
+        """
+        Places rare tickers, BATS and NYSE MKT in NYSE (in place)
         """
-        Converts dataframe to txt format
+        if isinstance(merged_df, BarStore):
+            self.normalize_exchanges(merged_df.index)
+            return merged_df
+        to_nyse = merged_df["ticker"].isin(self.rare_tickers) | merged_df[
+            "Exchange"
+        ].isin(self.nyse_exchanges)
+        merged_df.loc[to_nyse, "Exchange"] = "NYSE"
+        return merged_df
 
-        Some parsing is done to make sure the data is in the correct format
+    def txt_filename(self, exchange):
         """
-        # Place rare tickers in NYSE
-        rare_tickers = ["SVXY", "USMV", "UVXY", "VIXM", "VIXY", "VXX", "VXZ"]
-        merged_df.loc[merged_df["ticker"].isin(rare_tickers), "Exchange"] = "NYSE"
+        Path of the txt file of an exchange
+        """
+        if exchange == "NYSE ARCA":
+            return self.output_path + "NYSE.AMEX.TXT"
+        return self.output_path + f"{exchange}.TXT"
 
-        # Place BATS and NYSE MKT in NYSE
-        merged_df.loc[merged_df["Exchange"] == "BATS", "Exchange"] = "NYSE"
-        merged_df.loc[merged_df["Exchange"] == "NYSE MKT", "Exchange"] = "NYSE"
+    def format_txt(self, exchange_df):
+        """
+        Converts bars to the txt columns, sorted by ticker and date
 
-        exchange_df = merged_df[merged_df["Exchange"] == exchange].reset_index(
-            drop=True
+        Dates and volumes are converted with vectorized ops
+        """
+        exchange_df = exchange_df[list(self.columns_map)].rename(
+            columns=self.columns_map
         )
-        if "adjusted_close" in exchange_df.columns:
-            exchange_df.drop(
-                columns=["ticker", "esignal", "Exchange", "adjusted_close"],
-                inplace=True,
-            )
-        else:
-            exchange_df.drop(columns=["ticker", "esignal", "Exchange"], inplace=True)
-        exchange_df.rename(columns=self.columns_map, inplace=True)
         exchange_df["<PER>"] = "D"
         exchange_df["<TIME>"] = "000000"
-        exchange_df["<DATE>"] = exchange_df["<DATE>"].apply(
-            lambda x: x.replace("-", "")
-        )
-        exchange_df["<VOL>"] = exchange_df["<VOL>"].apply(lambda x: int(x))
+        # Dates from a BarStore are already YYYYMMDD ints
+        if not pd.api.types.is_integer_dtype(exchange_df["<DATE>"]):
+            exchange_df["<DATE>"] = (
+                exchange_df["<DATE>"].str.replace("-", "", regex=False).astype(int)
+            )
+        exchange_df["<VOL>"] = exchange_df["<VOL>"].astype("int64")
         exchange_df["<OPENINT>"] = 0
         exchange_df = exchange_df[self.ordered_cols]
-        exchange_df["<DATE>"] = exchange_df["<DATE>"].astype(int)
         exchange_df.sort_values(by=["<TICKER>", "<DATE>"], inplace=True)
         exchange_df.reset_index(drop=True, inplace=True)
-        exchange_df.to_csv(filename, sep=",", index=False)
+        return exchange_df
+
+    @staticmethod
+    def exchange_rows(merged_df):
+        """
+        Partitions the rows of a merged frame (or the tickers of a
+        BarStore index) by exchange in a single pass
+
+        Returns
+        -------
+        dict
+            Exchange -> row positions, in their original order
+        """
+        if isinstance(merged_df, BarStore):
+            merged_df = merged_df.index
+        codes, exchanges = pd.factorize(merged_df["Exchange"])
+        # Rows without an exchange (code -1) go to bucket 0 and are dropped
+        order = np.argsort(codes, kind="stable")
+        ends = np.cumsum(np.bincount(codes + 1, minlength=len(exchanges) + 1))
+        return {
+            exchange: order[ends[code] : ends[code + 1]]
+            for code, exchange in enumerate(exchanges)
+        }
+
+    def txt_chunks(self, merged_df, exchange, chunksize=500000, rows=None):
+        """
+        Yields the bars of an exchange in chunks of about `chunksize`
+        rows, in the order of its txt file
+
+        Every chunk holds whole <TICKER>s taken in sorted order, so
+        sorting each chunk by ticker and date sorts the whole file, and
+        only one chunk is materialized at a time.
+
+        Parameters
+        ----------
+        merged_df : DataFrame or BarStore
+            Output of get_eod_data() or get_bar_store()
+        exchange : str
+        chunksize : int, optional
+        rows : ndarray, optional
+            Positions of the exchange's rows (BarStore index rows for a
+            store), as returned by exchange_rows()
+        """
+        if rows is None:
+            rows = self.exchange_rows(merged_df).get(exchange)
+            if rows is None:
+                rows = np.array([], dtype=np.int64)
+        if isinstance(merged_df, BarStore):
+            index = merged_df.index.iloc[rows]
+            groups = index["ticker_id"]
+            lengths = (index["stop"] - index["start"]).to_numpy()
+        else:
+            groups = merged_df["ticker_id"].iloc[rows]
+            lengths = np.ones(len(rows), dtype=np.int64)
+
+        # Same order as sort_values(["<TICKER>", ...]): missing tickers last
+        codes, uniques = pd.factorize(groups, sort=True)
+        codes[codes < 0] = len(uniques)
+        order = np.argsort(codes, kind="stable")
+        group_ends = np.cumsum(np.bincount(codes, minlength=len(uniques) + 1))
+        group_rows = np.bincount(codes, weights=lengths, minlength=len(uniques) + 1)
+
+        def take(positions):
+            if isinstance(merged_df, BarStore):
+                return BarStore(index.iloc[positions], merged_df.columns).to_frame()
+            return merged_df.iloc[rows[positions]]
+
+        start, chunk_rows = 0, 0
+        for end, n_rows in zip(group_ends, group_rows):
+            chunk_rows += n_rows
+            if chunk_rows >= chunksize:
+                yield take(order[start:end])
+                start, chunk_rows = end, 0
+        if start < len(order):
+            yield take(order[start:])
+
+    # Converting dataframe to txt format
+    def exchange_df_to_txt(
+        self, merged_df, exchange, filename, chunksize=500000, rows=None
+    ):
+        """
+        Writes the bars of one exchange in txt format, formatting and
+        writing one chunk of txt_chunks() at a time (`rows` as there)
+
+        Returns
+        -------
+        int
+            Rows written
+        """
+        # An empty exchange still gets a file with the header
+        pd.DataFrame(columns=self.ordered_cols).to_csv(filename, sep=",", index=False)
+
+        n_rows = 0
+        for chunk in self.txt_chunks(merged_df, exchange, chunksize, rows):
+            with stage("formatting"):
+                chunk = self.format_txt(chunk)
+            with stage("txt_write"):
+                chunk.to_csv(filename, sep=",", index=False, header=False, mode="a")
+            n_rows += len(chunk)
 
         print(f"Saved {exchange}.TXT")
 
-        return exchange_df
+        return n_rows
 
-    def get_eod_data(self):
+    def sync_ticker(self, ticker, country):
+        """
+        Syncs a ticker against the local store, requesting only the
+        bars after the last synced date
+
+        The request starts at the last synced date, so the first bar
+        returned overlaps the stored one. If its close no longer matches,
+        the history was re-adjusted (e.g. a split) and it is refetched.
 
+        Parameters
+        ----------
+        ticker : str
+        country : str
+
+        Returns
+        -------
+        DataFrame
+            Full stored history of the ticker
+        """
+        state = self.store.last_synced(ticker)
+        if state is None:
+            records = self.get_eod_json(ticker, country)
+            return self.store.save(ticker, pd.DataFrame(parse_records(records)))
+
+        records = self.get_eod_json(ticker, country, from_date=state["last_date"])
+        new_df = pd.DataFrame(parse_records(records))
+        if new_df.empty:
+            return self.store.load(ticker)
+
+        overlap = new_df[new_df["date"] == state["last_date"]]
+        if overlap.empty or not np.isclose(
+            overlap["close"].iloc[0], state["last_close"]
+        ):
+            print(f"Adjustment detected for {ticker}, refetching history")
+            records = self.get_eod_json(ticker, country, refresh=True)
+            return self.store.save(ticker, pd.DataFrame(parse_records(records)))
+
+        new_df = new_df[new_df["date"] > state["last_date"]]
+        if new_df.empty:
+            return self.store.load(ticker)
+        return self.store.append(ticker, new_df)
+
+    def fetch_ticker(self, ticker):
+        """
+        Gets EOD data for a single ticker; the client paces every
+        request with the shared rate limiter
+
+        Parameters
+        ----------
+        ticker : str
+
+        Returns
+        -------
+        list or DataFrame
+            JSON records, one per bar, or the synced history
+            when a local store is used
+        """
+        with stage("ticker", item=ticker):
+            if self.store is not None:
+                return self.sync_ticker(ticker, "US")
+            return self.get_eod_json(ticker, "US")
+
+    def eod_tickers(self):
+        """
+        Returns the tickers to fetch and their exchanges
+        """
         us_symbols = self.get_us_symbols()
-        desired_tickers = self.tickers_df["esignal"].tolist()
-        obtained_tickers = us_symbols["Code"].tolist()
-        missing_tickers = list(set(desired_tickers) - set(obtained_tickers))
-
-        # Get eod data for all tickers
-        eod_df = pd.DataFrame()
-        tickers = us_symbols["Code"].tolist() + list(self.missing_tickers_dict.keys())
-        exchanges = us_symbols["Exchange"].tolist() + list(
-            self.missing_tickers_dict.values()
+        tickers = us_symbols["Code"].tolist()
+        exchanges = us_symbols["Exchange"].tolist()
+
+        # The curated missing_tickers_dict is always fetched, even when the
+        # universe has the ticker on another exchange or with another type
+        resolved = set(tickers)
+        for ticker, exchange in self.missing_tickers_dict.items():
+            if ticker not in resolved:
+                if ticker in self.universe:
+                    print(
+                        f"Override {ticker} ({exchange}) is filtered out of the "
+                        f"universe as {self.universe.exchange(ticker)} "
+                        f"{self.universe.type(ticker)}, fetching it anyway"
+                    )
+                tickers.append(ticker)
+                exchanges.append(exchange)
+
+        # Filtered tickers are in the universe but not of interest
+        not_selected = set(self.tickers_df["esignal"]) - set(tickers)
+        filtered = {ticker for ticker in not_selected if ticker in self.universe}
+        print(
+            f"{len(tickers)} tickers to fetch, {len(filtered)} filtered out, "
+            f"{len(not_selected) - len(filtered)} not found"
         )
+        return tickers, exchanges
+
+    def iter_eod_frames(self, window=None):
+        """
+        Fetches the EOD data of every ticker concurrently, yielding
+        the bars of each one in ticker order
 
-        counter = 0
+        At most `window` tickers are fetched or waiting to be consumed at
+        any time, so memory doesn't grow with the number of tickers.
 
-        for ticker, exchange in zip(tickers, exchanges):
+        Parameters
+        ----------
+        window : int, optional
+            Defaults to four times max_workers
+
+        Yields
+        ------
+        DataFrame
+            Bars of a ticker with "ticker" and "Exchange" columns
+        """
+        # Holidays are loaded before the fetch, so a failed download
+        # doesn't throw away hours of fetched bars
+        self.calendar.holidays
+        tickers, exchanges = self.eod_tickers()
+        window = window or self.max_workers * 4
+
+        def pop(pending):
+            position, future = pending.popleft()
             try:
-                df = self.get_eod_df(ticker, "US")
-                df["Exchange"] = exchange
-                eod_df = pd.concat([eod_df, df], ignore_index=True)
+                result = future.result()
             except Exception as e:
-                print(f"Error for {ticker}: {e}")
+                self.errors[tickers[position]] = str(e)
+                print(f"Error for {tickers[position]}: {e}")
+                return None
+            if position and position % 50 == 0:
+                print(f"Processed {position} tickers")
+            df = result if self.store is not None else pd.DataFrame(parse_records(result))
+            if df.empty:
+                return None
+            df["ticker"] = tickers[position]
+            df["Exchange"] = exchanges[position]
+            return df
+
+        self.errors = {}
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for position, ticker in enumerate(tickers):
+                pending.append((position, executor.submit(self.fetch_ticker, ticker)))
+                if len(pending) >= window:
+                    df = pop(pending)
+                    if df is not None:
+                        yield df
+            while pending:
+                df = pop(pending)
+                if df is not None:
+                    yield df
+
+        if self.store is not None:
+            self.store.save_manifest()
+
+    def collect_eod_data(self):
+        """
+        Fetches the EOD data of every ticker into an EODCollector
+        """
+        # Holidays are loaded before the fetch, so a failed download
+        # doesn't throw away hours of fetched bars
+        self.calendar.holidays
+        tickers, exchanges = self.eod_tickers()
+
+        # Fetch concurrently; the collector keeps results in ticker order
+        self.errors = {}
+        collector = EODCollector()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self.fetch_ticker, ticker): position
+                for position, ticker in enumerate(tickers)
+            }
+            for counter, future in enumerate(as_completed(futures), start=1):
+                # Popped so the raw JSON of the ticker is freed once it is collected
+                position = futures.pop(future)
+                try:
+                    result = future.result()
+                    with stage("dataframe_build"):
+                        if self.store is not None:
+                            collector.add_frame(
+                                position, tickers[position], exchanges[position], result
+                            )
+                        else:
+                            collector.add(
+                                position, tickers[position], exchanges[position], result
+                            )
+                except Exception as e:
+                    self.errors[tickers[position]] = str(e)
+                    print(f"Error for {tickers[position]}: {e}")
 
-            finally:
-                counter += 1
                 if counter % 50 == 0:
                     print(f"Processed {counter} tickers")
-                    time.sleep(2)
+
+        if self.store is not None:
+            self.store.save_manifest()
+
+        return collector
+
+    def get_eod_data(self):
+
+        collector = self.collect_eod_data()
+        with stage("dataframe_build"):
+            eod_df = collector.build()
 
         # Merge with tickers_df and get TXT files
-        merged_df = pd.merge(
-            eod_df,
-            self.tickers_df,
-            left_on="ticker",
-            right_on="esignal",
-            how="left",
-        )
+        with stage("merge"):
+            merged_df = pd.merge(
+                eod_df,
+                self.tickers_df,
+                left_on="ticker",
+                right_on="esignal",
+                how="left",
+            )
 
         merged_df = merged_df[
-            ~merged_df["date"].isin(self.undesired_dates)
+            ~self.calendar.is_holiday(dates_to_int32(merged_df["date"]))
         ].reset_index(drop=True)
 
         return merged_df
 
+    def get_bar_store(self, price_dtype=np.float64):
+        """
+        Same bars as get_eod_data(), kept in a compact BarStore instead
+        of a merged DataFrame
+
+        Parameters
+        ----------
+        price_dtype : dtype, optional
+            np.float32 halves the size of the prices
+
+        Returns
+        -------
+        BarStore
+        """
+        collector = self.collect_eod_data()
+        with stage("dataframe_build"):
+            store = BarStore.from_collector(collector, self.tickers_df, price_dtype)
+        return store.filter(~self.calendar.is_holiday(store.columns["date"]))
+
+    def check_bars(self, merged_df):
+        """
+        Compares the bars of every ticker with the trading days between
+        its first and last date
+
+        Returns
+        -------
+        DataFrame
+            first_date, last_date, bars, expected_bars and missing_bars
+            per ticker, for the tickers with missing bars
+        """
+        dates = pd.Series(dates_to_int32(merged_df["date"]), index=merged_df.index)
+        summary = dates.groupby(merged_df["ticker"]).agg(
+            first_date="min", last_date="max", bars="count"
+        )
+        summary["expected_bars"] = self.calendar.expected_bars(
+            summary["first_date"].to_numpy(), summary["last_date"].to_numpy()
+        )
+        summary["missing_bars"] = summary["expected_bars"] - summary["bars"]
+        return summary[summary["missing_bars"] > 0]
+
+    def save_to_sink(self, merged_df, sink):
+        """
+        Writes the bars of the merged frame to a sink, keyed on (ticker, date)
+
+        Parameters
+        ----------
+        merged_df : DataFrame
+            Output of get_eod_data()
+        sink : Sink
+            e.g. SQLiteSink("eod.db", "eod")
+        """
+        columns = ["ticker", "date", "open", "high", "low", "close", "volume"]
+        columns += [
+            column for column in ["adjusted_close", "Exchange"] if column in merged_df
+        ]
+        sink.write(merged_df[columns])
+
     def save_txt_files(self, merged_df):
         """
         Saving txt files for each exchange
+
+        Parameters
+        ----------
+        merged_df : DataFrame or BarStore
+            Output of get_eod_data() or get_bar_store()
+
+        Returns
+        -------
+        list
+            Rows written per exchange, in the order of exchanges_of_interest
         """
-        exchange_dfs = []
+        merged_df = self.normalize_exchanges(merged_df)
+
+        # Partition by exchange in a single pass; files are then written
+        # chunk by chunk, so no formatted copy of a whole exchange is built
+        partitions = self.exchange_rows(merged_df)
+        no_rows = np.array([], dtype=np.int64)
+
+        rows_written = []
         for exchange in self.exchanges_of_interest:
-            if exchange == "NYSE ARCA":
-                filename = self.output_path + "NYSE.AMEX.TXT"
-            else:
-                filename = self.output_path + f"{exchange}.TXT"
+            filename = self.txt_filename(exchange)
+            rows = partitions.get(exchange, no_rows)
+            rows_written.append(
+                self.exchange_df_to_txt(merged_df, exchange, filename, rows=rows)
+            )
+
+        return rows_written
 
-            exchange_df = self.exchange_df_to_txt(merged_df, exchange, filename)
-            exchange_dfs.append(exchange_df)
+    def save_columnar_files(self, merged_df, folder=None):
+        """
+        Saving Arrow IPC files for each exchange, next to the txt files
+
+        Parameters
+        ----------
+        merged_df : DataFrame or BarStore
+            Output of get_eod_data() or get_bar_store()
+        folder : str, optional
+            Prefix of the files, defaults to output_path
+
+        Returns
+        -------
+        list
+            Paths of the files, in the order of exchanges_of_interest
+        """
+        folder = self.output_path if folder is None else folder
+        merged_df = self.normalize_exchanges(merged_df)
+        if isinstance(merged_df, BarStore):
+            partitions = None
+        else:
+            partitions = dict(tuple(merged_df.groupby("Exchange", sort=False)))
+
+        paths = []
+        for exchange in self.exchanges_of_interest:
+            path = folder + f"{exchange}.arrow"
+            if partitions is None:
+                exchange_df = merged_df.to_frame(exchange)
+            else:
+                exchange_df = partitions.get(exchange, merged_df.iloc[0:0])
+            rows = write_exchange_file(exchange_df, path)
+            print(f"Saved {exchange}.arrow ({rows} rows)")
+            paths.append(path)
 
-        return exchange_dfs
+        return paths
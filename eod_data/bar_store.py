@@ -0,0 +1,267 @@
+# Compact in-memory store of the EOD bars
+
+import sys
+import numpy as np
+import pandas as pd
+
+# Local imports
+from eod_collector import EODCollector, _synthetic_records
+from eod_columnar import dates_to_int32
+from trading_calendar import int32_to_datetime64
+
+
+BAR_FIELDS = ["date", "open", "high", "low", "close", "adjusted_close", "volume"]
+
+
+class BarStore:
+    """
+    EOD bars kept as one typed array per field, grouped by ticker
+
+    Rows carry no ticker, exchange or ticker-info columns. Those live in
+    `index`, one row per ticker with the [start, stop) slice of its bars,
+    so per-ticker data is stored once instead of once per bar. Dates are
+    int32 YYYYMMDD values.
+
+    Parameters
+    ----------
+    index : DataFrame
+        One row per ticker with "ticker", "Exchange", "start" and "stop"
+        columns, plus any ticker info columns
+    columns : dict
+        Field name -> numpy array with the bars of every ticker
+    """
+
+    def __init__(self, index, columns):
+        self.index = index.reset_index(drop=True)
+        self.columns = columns
+        self.positions = {
+            ticker: row for row, ticker in enumerate(self.index["ticker"])
+        }
+
+    @classmethod
+    def from_collector(cls, collector, ticker_info=None, price_dtype=np.float64):
+        """
+        Builds a store from the chunks of an EODCollector
+
+        Parameters
+        ----------
+        collector : EODCollector
+        ticker_info : DataFrame, optional
+            Ticker info (e.g. tickers_df) joined on its "esignal" column
+        price_dtype : dtype, optional
+            np.float32 halves the size of the prices
+
+        Returns
+        -------
+        BarStore
+        """
+        chunks = [collector.chunks[position] for position in sorted(collector.chunks)]
+        lengths = np.array(
+            [len(next(iter(columns.values()))) for _, _, columns in chunks],
+            dtype=np.int64,
+        )
+        stops = np.cumsum(lengths)
+
+        fields = {}
+        for _, _, columns in chunks:
+            fields.update(dict.fromkeys(columns))
+
+        data = {}
+        for field in fields:
+            parts = []
+            for (_, _, columns), length in zip(chunks, lengths):
+                if field not in columns:
+                    parts.append(np.full(length, np.nan))
+                elif field == "date":
+                    # Converted chunk by chunk, so no object array of all dates is built
+                    parts.append(dates_to_int32(pd.Series(columns[field])))
+                else:
+                    parts.append(columns[field])
+            data[field] = np.concatenate(parts)
+            if field not in ("date", "volume"):
+                data[field] = data[field].astype(price_dtype, copy=False)
+
+        index = pd.DataFrame(
+            {
+                "ticker": [ticker for ticker, _, _ in chunks],
+                "Exchange": [exchange for _, exchange, _ in chunks],
+                "start": stops - lengths,
+                "stop": stops,
+            }
+        )
+        if ticker_info is not None:
+            index = index.merge(
+                ticker_info.drop_duplicates("esignal"),
+                left_on="ticker",
+                right_on="esignal",
+                how="left",
+            )
+        return cls(index, data)
+
+    @classmethod
+    def from_frame(cls, merged_df, price_dtype=np.float64):
+        """
+        Builds a store from a merged frame, e.g. the output of get_eod_data()
+        """
+        bar_fields = [column for column in BAR_FIELDS if column in merged_df]
+        collector = EODCollector()
+        for position, (ticker, ticker_df) in enumerate(
+            merged_df.groupby("ticker", sort=False)
+        ):
+            collector.add_frame(
+                position, ticker, ticker_df["Exchange"].iloc[0], ticker_df[bar_fields]
+            )
+        info_columns = [
+            column
+            for column in merged_df.columns
+            if column not in bar_fields and column not in ("ticker", "Exchange")
+        ]
+        ticker_info = None
+        if "esignal" in info_columns:
+            ticker_info = merged_df[info_columns].dropna(subset=["esignal"])
+        return cls.from_collector(collector, ticker_info, price_dtype)
+
+    def __len__(self):
+        return int(self.index["stop"].iloc[-1]) if len(self.index) else 0
+
+    def nbytes(self):
+        """
+        Bytes used by the bar arrays plus the ticker index
+        """
+        return sum(array.nbytes for array in self.columns.values()) + int(
+            self.index.memory_usage(deep=True).sum()
+        )
+
+    def ticker(self, ticker):
+        """
+        Returns the bars of a ticker as a dict of array views
+        """
+        row = self.index.iloc[self.positions[ticker]]
+        return {
+            field: array[row["start"] : row["stop"]]
+            for field, array in self.columns.items()
+        }
+
+    def filter(self, keep):
+        """
+        Returns a new store with only the bars where `keep` is True
+        """
+        kept = np.concatenate([[0], np.cumsum(keep)])
+        index = self.index.copy()
+        index["start"] = kept[index["start"].to_numpy()]
+        index["stop"] = kept[index["stop"].to_numpy()]
+        index = index[index["stop"] > index["start"]]
+        columns = {field: array[keep] for field, array in self.columns.items()}
+        return BarStore(index, columns)
+
+    @staticmethod
+    def _rows(index):
+        """
+        Row positions of the tickers of `index`, without a Python loop,
+        and the number of bars of each ticker
+        """
+        starts = index["start"].to_numpy()
+        lengths = index["stop"].to_numpy() - starts
+        offsets = np.cumsum(lengths) - lengths
+        return np.arange(lengths.sum()) - np.repeat(offsets - starts, lengths), lengths
+
+    def select(self, exchange):
+        """
+        Returns a new store with only the bars of one exchange
+        """
+        index = self.index[self.index["Exchange"] == exchange].copy()
+        rows, lengths = self._rows(index)
+        index["stop"] = np.cumsum(lengths)
+        index["start"] = index["stop"] - lengths
+        columns = {field: array[rows] for field, array in self.columns.items()}
+        return BarStore(index, columns)
+
+    def exchanges(self):
+        """
+        Sorted exchanges with at least one ticker
+        """
+        return sorted(self.index["Exchange"].dropna().unique())
+
+    def to_frame(self, exchange=None, dates_as_str=False):
+        """
+        Materializes the bars, of every ticker or of one exchange, in the
+        layout of the frame returned by get_eod_data()
+
+        Parameters
+        ----------
+        exchange : str, optional
+        dates_as_str : bool, optional
+            Return dates as YYYY-MM-DD strings instead of YYYYMMDD ints
+        """
+        index = self.index
+        if exchange is not None:
+            index = index[index["Exchange"] == exchange]
+        rows, lengths = self._rows(index)
+
+        data = {field: array[rows] for field, array in self.columns.items()}
+        if dates_as_str and "date" in data:
+            data["date"] = np.datetime_as_string(int32_to_datetime64(data["date"]))
+            data["date"] = data["date"].astype(object)
+        for column in index.columns:
+            if column not in ("start", "stop"):
+                data[column] = np.repeat(index[column].to_numpy(), lengths)
+        return pd.DataFrame(data)
+
+    def exchange_stores(self):
+        """
+        Yields (exchange, BarStore) pairs, one compact store per exchange,
+        e.g. to build each exchange's frame in another process
+        """
+        for exchange in self.exchanges():
+            yield exchange, self.select(exchange)
+
+    def exchange_frames(self, dates_as_str=True):
+        """
+        Yields (exchange, DataFrame) pairs, like merged_df.groupby("Exchange"),
+        materializing one exchange at a time
+        """
+        for exchange in self.exchanges():
+            yield exchange, self.to_frame(exchange, dates_as_str)
+
+
+def memory_per_million_bars(n_tickers=200, n_bars=5000):
+    """
+    Measures the memory of a synthetic merged frame against a BarStore
+
+    Returns
+    -------
+    dict
+        MB per million bars of the DataFrame and of the store
+    """
+    records = _synthetic_records(n_bars)
+    collector = EODCollector()
+    for i in range(n_tickers):
+        collector.add(i, f"T{i}", "NYSE", records)
+    ticker_info = pd.DataFrame(
+        {
+            "esignal": [f"T{i}" for i in range(n_tickers)],
+            "ticker_id": [f"T{i}" for i in range(n_tickers)],
+            "name": [f"Company {i}" for i in range(n_tickers)],
+        }
+    )
+
+    merged_df = pd.merge(
+        collector.build(), ticker_info, left_on="ticker", right_on="esignal", how="left"
+    )
+    frame_bytes = merged_df.memory_usage(deep=True).sum()
+    store = BarStore.from_collector(collector, ticker_info)
+    store32 = BarStore.from_collector(collector, ticker_info, price_dtype=np.float32)
+
+    millions = len(merged_df) / 1e6
+    return {
+        "bars": len(merged_df),
+        "frame_mb_per_million": frame_bytes / 1e6 / millions,
+        "store_mb_per_million": store.nbytes() / 1e6 / millions,
+        "store_float32_mb_per_million": store32.nbytes() / 1e6 / millions,
+    }
+
+
+if __name__ == "__main__":
+    # Usage: python bar_store.py [n_tickers] [n_bars]
+    args = [int(arg) for arg in sys.argv[1:3]]
+    print(memory_per_million_bars(*args))
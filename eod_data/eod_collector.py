@@ -0,0 +1,189 @@
+# Columnar collector for per-ticker EOD results
+
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+
+def parse_records(records):
+    """
+    Parses the JSON records returned by the EOD API straight
+    into typed numpy arrays, one per field
+
+    Parameters
+    ----------
+    records : list
+        List of dicts, one per bar
+
+    Returns
+    -------
+    dict
+        Field name -> numpy array
+    """
+    if not isinstance(records, list):
+        raise ValueError(f"Unexpected response: {records}")
+    if not records:
+        return {}
+
+    n_rows = len(records)
+    columns = {}
+    for field in records[0]:
+        values = (record.get(field) for record in records)
+        if field == "date":
+            columns[field] = np.fromiter(values, dtype=object, count=n_rows)
+        elif field == "volume":
+            try:
+                columns[field] = np.fromiter(values, dtype=np.int64, count=n_rows)
+            except (TypeError, ValueError):
+                values = (record.get(field) for record in records)
+                columns[field] = np.fromiter(
+                    (np.nan if value is None else value for value in values),
+                    dtype=np.float64,
+                    count=n_rows,
+                )
+        else:
+            columns[field] = np.fromiter(
+                (np.nan if value is None else value for value in values),
+                dtype=np.float64,
+                count=n_rows,
+            )
+    return columns
+
+
+class EODCollector:
+    """
+    Keeps per-ticker EOD results as columnar chunks and builds
+    the final DataFrame once, instead of concatenating a growing
+    DataFrame on every ticker
+    """
+
+    def __init__(self):
+        self.chunks = {}
+
+    def add(self, position, ticker, exchange, records):
+        """
+        Parses and stores the records of a ticker
+
+        Parameters
+        ----------
+        position : int
+            Position of the ticker in the output
+        ticker : str
+        exchange : str
+        records : list
+            JSON records from the EOD API
+        """
+        columns = parse_records(records)
+        if columns:
+            self.chunks[position] = (ticker, exchange, columns)
+
+    def add_frame(self, position, ticker, exchange, df):
+        """
+        Stores the bars of a ticker that are already in a DataFrame
+        (e.g. loaded from the local store)
+        """
+        if not df.empty:
+            columns = {column: df[column].to_numpy() for column in df.columns}
+            self.chunks[position] = (ticker, exchange, columns)
+
+    def build(self):
+        """
+        Builds the DataFrame with one concatenation per column,
+        ordered by position
+
+        Returns
+        -------
+        DataFrame
+            Bars with "ticker" and "Exchange" columns
+        """
+        if not self.chunks:
+            return pd.DataFrame()
+
+        chunks = [self.chunks[position] for position in sorted(self.chunks)]
+        lengths = [len(next(iter(columns.values()))) for _, _, columns in chunks]
+
+        fields = {}
+        for _, _, columns in chunks:
+            fields.update(dict.fromkeys(columns))
+
+        data = {}
+        for field in fields:
+            parts = []
+            for (_, _, columns), length in zip(chunks, lengths):
+                if field in columns:
+                    parts.append(columns[field])
+                else:
+                    parts.append(np.full(length, np.nan))
+            data[field] = np.concatenate(parts)
+
+        data["ticker"] = np.repeat(
+            np.array([ticker for ticker, _, _ in chunks], dtype=object), lengths
+        )
+        data["Exchange"] = np.repeat(
+            np.array([exchange for _, exchange, _ in chunks], dtype=object), lengths
+        )
+
+        return pd.DataFrame(data)
+
+
+def _synthetic_records(n_bars):
+    dates = pd.bdate_range("2000-01-03", periods=n_bars).strftime("%Y-%m-%d")
+    return [
+        {
+            "date": date,
+            "open": 10.0 + i,
+            "high": 11.0 + i,
+            "low": 9.0 + i,
+            "close": 10.5 + i,
+            "volume": 1000 + i,
+        }
+        for i, date in enumerate(dates)
+    ]
+
+
+def benchmark(n_tickers, n_bars=250):
+    """
+    Compares the old concat-in-a-loop accumulation against
+    EODCollector on synthetic data
+
+    Returns
+    -------
+    dict
+        Seconds and peak MB for each method
+    """
+    records = _synthetic_records(n_bars)
+    results = {"tickers": n_tickers}
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    eod_df = pd.DataFrame()
+    for i in range(n_tickers):
+        df = pd.DataFrame(records)
+        df["ticker"] = f"T{i}"
+        df["Exchange"] = "NYSE"
+        eod_df = pd.concat([eod_df, df], ignore_index=True)
+    results["concat_seconds"] = time.perf_counter() - start
+    results["concat_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    del eod_df
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    collector = EODCollector()
+    for i in range(n_tickers):
+        collector.add(i, f"T{i}", "NYSE", records)
+    collector.build()
+    results["collector_seconds"] = time.perf_counter() - start
+    results["collector_peak_mb"] = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+
+    return results
+
+
+if __name__ == "__main__":
+    # Usage: python eod_collector.py [n_tickers ...]
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 5000, 20000]
+    for size in sizes:
+        print(benchmark(size))
@@ -0,0 +1,139 @@
+# Columnar (Arrow IPC) export of the EOD bars
+
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+# Local imports
+from excel_workbooks import ticker_slices
+
+
+# Compact dtype of every exported field, in file order
+FIELD_TYPES = {
+    "date": pa.int32(),
+    "open": pa.float32(),
+    "high": pa.float32(),
+    "low": pa.float32(),
+    "close": pa.float32(),
+    "adjusted_close": pa.float32(),
+    "volume": pa.int64(),
+}
+
+
+def dates_to_int32(dates):
+    """
+    Converts YYYY-MM-DD date strings to YYYYMMDD int32 values
+    """
+    if pd.api.types.is_integer_dtype(dates):
+        return dates.to_numpy(dtype=np.int32)
+    return dates.str.replace("-", "", regex=False).astype(np.int32).to_numpy()
+
+
+def write_exchange_file(exchange_df, path):
+    """
+    Writes the bars of one exchange as an Arrow IPC file
+
+    Every ticker is written as its own record batch, and the tickers and
+    their row offsets are kept in the schema metadata, so a single ticker
+    can be read without touching the rest of the file.
+
+    Parameters
+    ----------
+    exchange_df : DataFrame
+        Rows of one exchange
+    path : str
+        Path of the file
+
+    Returns
+    -------
+    int
+        Rows written
+    """
+    sorted_df, slices = ticker_slices(exchange_df)
+    fields = [field for field in FIELD_TYPES if field in sorted_df]
+
+    arrays = {}
+    for field in fields:
+        if field == "date":
+            arrays[field] = dates_to_int32(sorted_df[field])
+        elif field == "volume":
+            arrays[field] = sorted_df[field].fillna(0).to_numpy(dtype=np.int64)
+        else:
+            arrays[field] = sorted_df[field].to_numpy(dtype=np.float32)
+
+    metadata = {
+        "tickers": json.dumps([ticker for ticker, _, _ in slices]),
+        "offsets": json.dumps([int(start) for _, start, _ in slices] + [len(sorted_df)]),
+    }
+    schema = pa.schema(
+        [pa.field(field, FIELD_TYPES[field]) for field in fields], metadata=metadata
+    )
+
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        for _, start, stop in slices:
+            writer.write_batch(
+                pa.record_batch(
+                    [pa.array(arrays[field][start:stop]) for field in fields],
+                    schema=schema,
+                )
+            )
+    return len(sorted_df)
+
+
+class ExchangeFile:
+    """
+    Memory-mapped reader of an exchange file written by write_exchange_file
+
+    Batches are read straight from the mapped file, so no bars are copied
+    until they are converted to pandas.
+
+    Parameters
+    ----------
+    path : str
+    """
+
+    def __init__(self, path):
+        self.source = pa.memory_map(path, "r")
+        self.reader = pa.ipc.open_file(self.source)
+
+        metadata = self.reader.schema.metadata
+        self.tickers = json.loads(metadata[b"tickers"])
+        self.offsets = json.loads(metadata[b"offsets"])
+        self.index = {ticker: position for position, ticker in enumerate(self.tickers)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def ticker(self, ticker):
+        """
+        Returns the bars of a ticker as a RecordBatch
+        """
+        return self.reader.get_batch(self.index[ticker])
+
+    def table(self):
+        """
+        Returns every bar of the exchange as a Table, in ticker order
+        """
+        return self.reader.read_all()
+
+    def to_pandas(self, ticker=None):
+        """
+        Returns the bars of a ticker, or of the whole exchange with a
+        ticker column, as a DataFrame
+        """
+        if ticker is not None:
+            return self.ticker(ticker).to_pandas()
+        df = self.table().to_pandas()
+        df.insert(
+            0,
+            "ticker",
+            np.repeat(np.array(self.tickers, dtype=object), np.diff(self.offsets)),
+        )
+        return df
+
+    def close(self):
+        self.source.close()
@@ -0,0 +1,106 @@
+# Local per-ticker store for incremental EOD syncs
+
+import os
+import json
+import threading
+import pandas as pd
+
+
+class EODStore:
+    """
+    Keeps the EOD history of each ticker as a Parquet file, plus a
+    manifest with the last synced date and close of every ticker
+
+    The Parquet files are the source of truth for incremental syncs; the
+    manifest is a summary written at the end of a run.
+
+    Parameters
+    ----------
+    store_path : str
+        Folder where the Parquet files and manifest are kept
+    """
+
+    def __init__(self, store_path):
+        self.store_path = store_path
+        os.makedirs(self.store_path, exist_ok=True)
+
+        self.manifest_path = os.path.join(self.store_path, "manifest.json")
+        self.lock = threading.Lock()
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, "r", encoding="utf-8") as file:
+                self.manifest = json.load(file)
+        else:
+            self.manifest = {}
+
+    def ticker_path(self, ticker):
+        """
+        Path of the Parquet file of a ticker
+        """
+        return os.path.join(self.store_path, ticker.replace("/", "_") + ".parquet")
+
+    def last_synced(self, ticker):
+        """
+        Returns the last stored bar of a ticker ({"last_date", "last_close"})
+        or None if it has never been synced
+
+        Read from the ticker's Parquet file, which is always written before
+        the manifest, so a run that died before save_manifest() doesn't
+        leave a stale last_date behind.
+        """
+        path = self.ticker_path(ticker)
+        if not os.path.exists(path):
+            return None
+        df = pd.read_parquet(path, columns=["date", "close"])
+        if df.empty:
+            return None
+        return {
+            "last_date": df["date"].iloc[-1],
+            "last_close": float(df["close"].iloc[-1]),
+        }
+
+    def load(self, ticker):
+        """
+        Loads the stored bars of a ticker
+        """
+        return pd.read_parquet(self.ticker_path(ticker))
+
+    def save(self, ticker, df):
+        """
+        Overwrites the stored bars of a ticker and updates its manifest entry
+
+        The file is replaced atomically, so it never holds a partial write.
+        """
+        df = df.reset_index(drop=True)
+        path = self.ticker_path(ticker)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        df.to_parquet(tmp_path, index=False)
+        os.replace(tmp_path, path)
+        if not df.empty:
+            with self.lock:
+                self.manifest[ticker] = {
+                    "last_date": df["date"].iloc[-1],
+                    "last_close": float(df["close"].iloc[-1]),
+                }
+        return df
+
+    def append(self, ticker, new_df):
+        """
+        Appends new bars to the stored bars of a ticker, skipping the
+        dates that are already stored
+        """
+        stored_df = self.load(ticker)
+        new_df = new_df[~new_df["date"].isin(stored_df["date"])]
+        if new_df.empty:
+            return stored_df
+        df = pd.concat([stored_df, new_df], ignore_index=True)
+        return self.save(ticker, df)
+
+    def save_manifest(self):
+        """
+        Writes the manifest to disk
+        """
+        with self.lock:
+            tmp_path = self.manifest_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(self.manifest, file)
+            os.replace(tmp_path, self.manifest_path)
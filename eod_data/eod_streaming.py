@@ -0,0 +1,178 @@
+# Out-of-core mode of the EOD pipeline
+
+import os
+import csv
+import heapq
+import shutil
+import tempfile
+import pandas as pd
+
+# Local imports
+from bar_store import BAR_FIELDS
+from eod_columnar import dates_to_int32
+from excel_workbooks import TickerWorkbook
+
+
+class StreamingEODPipeline:
+    """
+    Runs get_eod_data -> save_txt_files -> Excel workbooks without ever
+    holding the whole history in memory
+
+    Tickers are fetched in order through a bounded window, merged with
+    tickers_df, filtered and normalized one at a time, and appended to
+    per-exchange outputs:
+
+    - Excel: each ticker is written to its sheet as soon as it arrives.
+    - TXT: bars are buffered up to `chunk_rows` rows, then written as
+      sorted run files that are merged into the final files at the end.
+
+    Peak memory depends on `chunk_rows` and `window`, not on the size of
+    the universe, and the outputs are the same as in batch mode.
+
+    Parameters
+    ----------
+    extractor : EODExtractor
+    chunk_rows : int, optional
+        Rows buffered before a TXT run is written
+    window : int, optional
+        Tickers fetched ahead, see EODExtractor.iter_eod_frames()
+    spill_dir : str, optional
+        Folder for the run files, defaults to the system temp folder
+    """
+
+    def __init__(self, extractor, chunk_rows=500000, window=None, spill_dir=None):
+        self.extractor = extractor
+        self.chunk_rows = chunk_rows
+        self.window = window
+        self.spill_dir = spill_dir
+
+        # Fixed header, so every ticker has the same columns whatever
+        # fields its response has (missing ones are left empty)
+        self.columns = BAR_FIELDS + ["ticker", "Exchange"]
+        self.columns += [
+            column
+            for column in extractor.tickers_df.columns
+            if column not in self.columns
+        ]
+
+    def prepare(self, df):
+        """
+        Merges the bars of a ticker with tickers_df, drops holidays,
+        normalizes the exchange, as get_eod_data() does for all of them,
+        and reindexes the result to the fixed header
+        """
+        extractor = self.extractor
+        merged_df = pd.merge(
+            df, extractor.tickers_df, left_on="ticker", right_on="esignal", how="left"
+        )
+        merged_df = merged_df[
+            ~extractor.calendar.is_holiday(dates_to_int32(merged_df["date"]))
+        ].reset_index(drop=True)
+        return extractor.normalize_exchanges(merged_df).reindex(columns=self.columns)
+
+    def spill(self, buffers, runs, folder):
+        """
+        Writes the buffered bars of every exchange as sorted run files
+        """
+        for exchange, frames in buffers.items():
+            if not frames:
+                continue
+            path = os.path.join(folder, f"{exchange}.{len(runs[exchange])}.csv")
+            self.extractor.format_txt(pd.concat(frames, ignore_index=True)).to_csv(
+                path, sep=",", index=False, header=False
+            )
+            runs[exchange].append(path)
+            frames.clear()
+
+    @staticmethod
+    def _keyed_lines(file):
+        # Same order as sort_values(["<TICKER>", "<DATE>"]): missing tickers last
+        for line in file:
+            row = next(csv.reader([line]))
+            yield (row[0] == "", row[0], int(row[2])), line
+
+    def merge_runs(self, paths, filename):
+        """
+        Merges sorted run files into a txt file with a k-way merge
+        """
+        pd.DataFrame(columns=self.extractor.ordered_cols).to_csv(
+            filename, sep=",", index=False
+        )
+        files = [open(path, "r", newline="") for path in paths]
+        try:
+            with open(filename, "a", newline="") as output:
+                for _, line in heapq.merge(*map(self._keyed_lines, files)):
+                    output.write(line)
+        finally:
+            for file in files:
+                file.close()
+
+    def run(self, txt=True, excel_folder=None, upload=None):
+        """
+        Runs the pipeline
+
+        Parameters
+        ----------
+        txt : bool, optional
+            Write the txt files of exchanges_of_interest
+        excel_folder : str, optional
+            Write one workbook per exchange to this folder
+        upload : callable, optional
+            Called with the file name of every finished workbook
+
+        Returns
+        -------
+        list
+            Exchanges with a workbook, sorted like merged_df.groupby("Exchange")
+        """
+        extractor = self.extractor
+        folder = tempfile.mkdtemp(dir=self.spill_dir)
+        runs = {exchange: [] for exchange in extractor.exchanges_of_interest}
+        buffers = {exchange: [] for exchange in extractor.exchanges_of_interest}
+        buffered_rows = 0
+        workbooks = {}
+        sheets = set()
+
+        try:
+            for df in extractor.iter_eod_frames(self.window):
+                df = self.prepare(df)
+                if df.empty or pd.isna(df["Exchange"].iloc[0]):
+                    continue
+                exchange = df["Exchange"].iloc[0]
+
+                if excel_folder is not None:
+                    if exchange not in workbooks:
+                        workbooks[exchange] = TickerWorkbook(
+                            excel_folder + f"{exchange}.xlsx", self.columns
+                        )
+                    ticker = df["ticker"].iloc[0]
+                    # Finished sheets can't be reopened in constant memory mode
+                    if ticker in sheets:
+                        print(f"Skipping repeated sheet for {ticker}")
+                    else:
+                        workbooks[exchange].add_ticker(ticker, df)
+                        sheets.add(ticker)
+
+                if txt and exchange in buffers:
+                    buffers[exchange].append(df)
+                    buffered_rows += len(df)
+                    if buffered_rows >= self.chunk_rows:
+                        self.spill(buffers, runs, folder)
+                        buffered_rows = 0
+
+            if txt:
+                self.spill(buffers, runs, folder)
+                for exchange, paths in runs.items():
+                    self.merge_runs(paths, extractor.txt_filename(exchange))
+                    print(f"Saved {exchange}.TXT")
+        finally:
+            for workbook in workbooks.values():
+                workbook.close()
+            shutil.rmtree(folder, ignore_errors=True)
+
+        exchanges = sorted(workbooks)
+        for exchange in exchanges:
+            print(f"Finished writing {exchange} data to Excel file")
+            if upload is not None:
+                upload(f"{exchange}.xlsx")
+        return exchanges
@@ -0,0 +1,202 @@
+# Builds the per-exchange EOD Excel workbooks
+
+import os
+import time
+import numpy as np
+import pandas as pd
+import xlsxwriter
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+
+# Local imports
+from common.instrumentation import get_instrumentation, stage
+
+
+def ticker_slices(group_df):
+    """
+    Groups the rows of an exchange by ticker with a single stable sort
+
+    Tickers keep the order in which they first appear and rows keep
+    their order within each ticker.
+
+    Parameters
+    ----------
+    group_df : DataFrame
+        Rows of one exchange
+
+    Returns
+    -------
+    tuple
+        Sorted DataFrame and a list of (ticker, start, stop) row slices
+    """
+    codes, tickers = pd.factorize(group_df["ticker"])
+    order = np.argsort(codes, kind="stable")
+    counts = np.bincount(codes, minlength=len(tickers))
+    stops = np.cumsum(counts)
+    starts = stops - counts
+    return group_df.iloc[order], list(zip(tickers, starts, stops))
+
+
+class TickerWorkbook:
+    """
+    Workbook with one sheet per ticker, written with xlsxwriter's constant
+    memory mode, which flushes every row to disk as soon as it is written
+
+    Constant memory mode keeps a temp file open per sheet until the
+    workbook is closed, so the file of a sheet is closed as soon as the
+    sheet is finished (xlsxwriter reopens it when assembling the file).
+    Only one file per workbook is open at a time, whatever the number
+    of tickers.
+
+    Parameters
+    ----------
+    path : str
+        Path of the workbook
+    columns : list
+        Header of every sheet
+    """
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = list(columns)
+        self.workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+        self.header_format = self.workbook.add_format(
+            {"bold": True, "border": 1, "align": "center", "valign": "top"}
+        )
+
+    def add_ticker(self, ticker, ticker_df):
+        """
+        Writes the rows of a ticker to a new sheet
+        """
+        with stage("excel_sheet", item=ticker):
+            self._write_sheet(ticker, ticker_df)
+
+    def _write_sheet(self, ticker, ticker_df):
+        # Replace any forward slashes in the ticker name with underscores
+        worksheet = self.workbook.add_worksheet(ticker.replace("/", "_"))
+        worksheet.write_row(0, 0, self.columns, self.header_format)
+
+        # None instead of NaN so missing values are left as blank cells
+        ticker_df = ticker_df.reindex(columns=self.columns).astype(object)
+        values = ticker_df.where(ticker_df.notna(), None).to_numpy()
+        for row, row_values in enumerate(values, start=1):
+            worksheet.write_row(row, 0, row_values)
+
+        # Same call xlsxwriter makes on close(); the last row stays buffered
+        worksheet._opt_close()
+
+    def close(self):
+        self.workbook.close()
+
+
+def write_workbook(group_df, path):
+    """
+    Writes one sheet per ticker of an exchange
+
+    Parameters
+    ----------
+    group_df : DataFrame
+        Rows of one exchange
+    path : str
+        Path of the workbook
+    """
+    sorted_df, slices = ticker_slices(group_df)
+    workbook = TickerWorkbook(path, sorted_df.columns)
+    for ticker, start, stop in slices:
+        workbook.add_ticker(ticker, sorted_df.iloc[start:stop])
+    workbook.close()
+
+
+def build_exchange_workbook(exchange, group_df, folder="/tmp/"):
+    """
+    Builds the workbook of an exchange
+
+    Parameters
+    ----------
+    exchange : str
+    group_df : DataFrame or BarStore
+        Rows of the exchange. A BarStore is materialized here, in the
+        worker process
+    folder : str, optional
+
+    Returns
+    -------
+    tuple
+        Exchange, file name of the workbook and seconds spent writing it
+    """
+    filename = f"{exchange}.xlsx"
+    start = time.perf_counter()
+    if not isinstance(group_df, pd.DataFrame):
+        group_df = group_df.to_frame(dates_as_str=True)
+    write_workbook(group_df, folder + filename)
+    return exchange, filename, time.perf_counter() - start
+
+
+def build_workbooks(grouped, upload, max_workers=None, folder="/tmp/"):
+    """
+    Builds the workbook of every exchange in parallel processes,
+    uploading each one as soon as it is finished while the others
+    are still being built
+
+    `grouped` is consumed lazily: an exchange is only taken from it
+    when a process is free, so at most `max_workers` groups are
+    materialized (and pickled) at a time.
+
+    Parameters
+    ----------
+    grouped : iterable
+        (exchange, DataFrame or BarStore) pairs, e.g. a DataFrameGroupBy
+        or BarStore.exchange_stores()
+    upload : callable
+        Called with the file name of every finished workbook
+    max_workers : int, optional
+        Number of processes building workbooks, defaults to the CPU count
+    folder : str, optional
+        Folder where workbooks are written
+
+    Returns
+    -------
+    list
+        Exchanges, in the order of `grouped`
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    groups = enumerate(grouped)
+    with ProcessPoolExecutor(max_workers=max_workers) as builders, ThreadPoolExecutor(
+        max_workers=2
+    ) as uploaders:
+
+        futures = {}
+
+        def submit_next():
+            group = next(groups, None)
+            if group is None:
+                return False
+            position, (exchange, group_df) = group
+            future = builders.submit(build_exchange_workbook, exchange, group_df, folder)
+            futures[future] = position
+            return True
+
+        while len(futures) < max_workers and submit_next():
+            pass
+
+        exchanges = {}
+        uploads = []
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                # Workbooks are written in other processes, so they are timed there
+                exchange, filename, seconds = future.result()
+                get_instrumentation().observe("excel_write", seconds, item=exchange)
+                print(f"Finished writing {exchange} data to Excel file")
+                exchanges[futures.pop(future)] = exchange
+                uploads.append(uploaders.submit(upload, filename))
+                submit_next()
+
+        for upload_future in uploads:
+            upload_future.result()
+
+    return [exchanges[position] for position in sorted(exchanges)]
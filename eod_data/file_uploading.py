@@ -1,21 +1,47 @@
 # Imports
+import os
 import boto3
+import threading
 
 # Local Imports
 from keys import aws_keys
+from common.s3_upload import MultipartUploader
+from common.instrumentation import get_instrumentation, stage
 
 
-def upload_to_s3(filename, bucket_name, folder):
-    session = boto3.Session(
-        aws_access_key_id=aws_keys["ACCESS_KEY"],
-        aws_secret_access_key=aws_keys["SECRET_KEY"],
-    )
-    s3_client = session.client("s3")
-
-    with open("/tmp/" + filename, "rb") as file:
-        object = file.read()
-        s3_client.put_object(
-            Body=object,
-            Bucket=bucket_name,
-            Key=folder + "/" + filename,
-        )
\ No newline at end of file
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+
+def get_s3_client():
+    """
+    Returns an S3 client, created once and reused on every upload
+    """
+    global _s3_client
+    with _s3_client_lock:
+        if _s3_client is None:
+            session = boto3.Session(
+                aws_access_key_id=aws_keys["ACCESS_KEY"],
+                aws_secret_access_key=aws_keys["SECRET_KEY"],
+            )
+            _s3_client = session.client("s3")
+        return _s3_client
+
+
+def upload_to_s3(filename, bucket_name, folder, uploader=None):
+    """
+    Uploads /tmp/<filename> to <folder>/<filename> in the bucket,
+    streaming it in resumable multipart chunks
+
+    Parameters
+    ----------
+    filename : str
+    bucket_name : str
+    folder : str
+    uploader : MultipartUploader, optional
+        Uploader to use, defaults to one on the cached client
+    """
+    uploader = uploader or MultipartUploader(get_s3_client())
+    with stage("s3_upload", item=filename):
+        uploader.upload_file("/tmp/" + filename, bucket_name, folder + "/" + filename)
+    get_instrumentation().add_bytes("s3_upload", os.path.getsize("/tmp/" + filename))
@@ -0,0 +1,144 @@
+# Persisted index of the US symbol lists
+
+import os
+import json
+import threading
+import pandas as pd
+
+
+class SymbolUniverse:
+    """
+    Active and delisted symbols of an exchange, keyed by code
+
+    Every code is kept once (the active entry wins over a delisted one),
+    so exchange and type lookups are dict lookups. The index is saved to
+    a JSON file, and refresh() applies only the differences with the
+    latest symbol lists.
+
+    Parameters
+    ----------
+    path : str
+        JSON file where the index is kept
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as file:
+                self.symbols = json.load(file)
+        else:
+            self.symbols = {}
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __contains__(self, code):
+        return code in self.symbols
+
+    def get(self, code):
+        """
+        Returns the entry of a code, or None
+        """
+        return self.symbols.get(code)
+
+    def exchange(self, code):
+        entry = self.symbols.get(code)
+        return entry["Exchange"] if entry else None
+
+    def type(self, code):
+        entry = self.symbols.get(code)
+        return entry["Type"] if entry else None
+
+    def save(self):
+        """
+        Writes the index to disk
+        """
+        with self.lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(self.symbols, file)
+            os.replace(tmp_path, self.path)
+
+    def refresh(self, active, delisted=()):
+        """
+        Applies the differences with the latest symbol lists
+
+        Parameters
+        ----------
+        active : list
+            Records of the exchange-symbol-list endpoint
+        delisted : list, optional
+            Records of the same endpoint with delisted=1
+
+        Returns
+        -------
+        dict
+            Number of codes added, removed and changed
+        """
+        latest = {}
+        for is_delisted, records in [(False, active), (True, delisted)]:
+            for record in records:
+                if record["Code"] not in latest:
+                    latest[record["Code"]] = dict(record, Delisted=is_delisted)
+
+        with self.lock:
+            added = [code for code in latest if code not in self.symbols]
+            removed = [code for code in self.symbols if code not in latest]
+            changed = [
+                code
+                for code in latest
+                if code in self.symbols and self.symbols[code] != latest[code]
+            ]
+            for code in removed:
+                del self.symbols[code]
+            for code in added + changed:
+                self.symbols[code] = latest[code]
+
+        diff = {"added": len(added), "removed": len(removed), "changed": len(changed)}
+        if any(diff.values()):
+            self.save()
+        print(f"Symbol universe: {len(self.symbols)} codes, {diff}")
+        return diff
+
+    def select(self, codes, exchanges=None, types=None, normalize=None):
+        """
+        Returns the entries of the given codes that pass the filters
+
+        Parameters
+        ----------
+        codes : iterable
+        exchanges : list, optional
+            Exchanges to keep, compared after `normalize`
+        types : list, optional
+            Types to keep, e.g. ["Common Stock", "ETF"]
+        normalize : callable, optional
+            Called as normalize(code, exchange), returns the exchange
+            used by the filter
+
+        Returns
+        -------
+        DataFrame
+            One row per code found, in the order of `codes`
+        """
+        exchanges = set(exchanges) if exchanges is not None else None
+        types = set(types) if types is not None else None
+
+        rows = []
+        with self.lock:
+            # dict.fromkeys drops repeated codes and keeps their order
+            for code in dict.fromkeys(codes):
+                entry = self.symbols.get(code)
+                if entry is None:
+                    continue
+                if types is not None and entry.get("Type") not in types:
+                    continue
+                exchange = entry.get("Exchange")
+                if normalize is not None:
+                    exchange = normalize(code, exchange)
+                if exchanges is not None and exchange not in exchanges:
+                    continue
+                rows.append(entry)
+        if not rows:
+            return pd.DataFrame(columns=["Code", "Exchange", "Type"])
+        return pd.DataFrame(rows)
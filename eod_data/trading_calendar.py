@@ -0,0 +1,230 @@
+# Trading calendar compiled from the exchange-details holidays
+
+import os
+import json
+import time
+import tempfile
+import threading
+import numpy as np
+
+# Local imports
+from common.http_client import get_default_client
+
+# ExchangeHolidays types on which the exchange is closed. Bank holidays
+# (e.g. Columbus Day, Veterans Day) are listed too, but are trading days
+CLOSURE_TYPES = ("official",)
+
+
+def int32_to_datetime64(dates):
+    """
+    Converts YYYYMMDD int values to datetime64[D]
+    """
+    dates = np.asarray(dates, dtype=np.int64)
+    years = (dates // 10000 - 1970).astype("datetime64[Y]")
+    months = years.astype("datetime64[M]") + (dates // 100 % 100 - 1)
+    return months.astype("datetime64[D]") + (dates % 100 - 1)
+
+
+def datetime64_to_int32(dates):
+    """
+    Converts datetime64 values to YYYYMMDD int32 values
+    """
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    months = dates.astype("datetime64[M]")
+    years = months.astype("datetime64[Y]").astype(np.int64) + 1970
+    month_numbers = months.astype(np.int64) % 12 + 1
+    days = (dates - months.astype("datetime64[D]")).astype(np.int64) + 1
+    return (years * 10000 + month_numbers * 100 + days).astype(np.int32)
+
+
+class TradingCalendar:
+    """
+    Holidays of an exchange as a sorted int32 YYYYMMDD array
+
+    The closures are downloaded from the exchange-details endpoint at most
+    once every `max_age` seconds and kept in a local JSON file. If they
+    can't be downloaded, the local file is used even when it is stale,
+    and without one a RuntimeError is raised. Lookups
+    are binary searches over the compiled array, and business-day counts
+    use a numpy busdaycalendar built from it.
+
+    Parameters
+    ----------
+    holidays_url : str
+        exchange-details URL of the exchange
+    cache_path : str, optional
+        JSON file where the downloaded holidays are kept
+    max_age : float, optional
+        Seconds before the holidays are downloaded again
+    extra_holidays : list, optional
+        YYYY-MM-DD dates treated as holidays on top of the downloaded ones
+    closure_types : tuple, optional
+        Holiday types kept from the endpoint, compared in lower case
+    client : HttpClient, optional
+        HTTP client, defaults to the shared one
+    """
+
+    def __init__(
+        self,
+        holidays_url,
+        cache_path=os.path.join(tempfile.gettempdir(), "trading-calendar-US.json"),
+        max_age=7 * 24 * 3600,
+        extra_holidays=(),
+        closure_types=CLOSURE_TYPES,
+        client=None,
+    ):
+        self.holidays_url = holidays_url
+        self.cache_path = cache_path
+        self.max_age = max_age
+        self.extra_holidays = list(extra_holidays)
+        self.closure_types = [closure_type.lower() for closure_type in closure_types]
+        self.client = client or get_default_client()
+
+        self.lock = threading.Lock()
+        self._holidays = None
+        self._busdaycal = None
+
+    def fetch_holidays(self):
+        """
+        Downloads the dates on which the exchange is closed
+
+        Returns
+        -------
+        list
+            YYYY-MM-DD dates of the holidays whose type is in closure_types
+        """
+        response = self.client.get(self.holidays_url)
+        response.raise_for_status()
+        holidays = response.json()["ExchangeHolidays"].values()
+        return [
+            holiday["Date"]
+            for holiday in holidays
+            if holiday.get("Type", "").lower() in self.closure_types
+        ]
+
+    def load_holidays(self):
+        """
+        Returns the holiday dates from the local file, downloading them
+        when the file is missing, older than max_age or was built with
+        other closure_types
+        """
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as file:
+                cached = json.load(file)
+            if cached["closure_types"] != self.closure_types:
+                cached = None
+            elif time.time() - cached["fetched"] < self.max_age:
+                return cached["dates"]
+        except (OSError, ValueError, KeyError):
+            cached = None
+
+        try:
+            dates = self.fetch_holidays()
+        except Exception as e:
+            if cached is None:
+                raise RuntimeError(
+                    f"Couldn't get the holidays and there is no {self.cache_path}: {e}"
+                ) from e
+            age = (time.time() - cached["fetched"]) / 86400
+            print(f"Error getting holidays, using {age:.0f} days old ones: {e}")
+            return cached["dates"]
+
+        tmp_path = f"{self.cache_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "fetched": time.time(),
+                    "closure_types": self.closure_types,
+                    "dates": dates,
+                },
+                file,
+            )
+        os.replace(tmp_path, self.cache_path)
+        return dates
+
+    @property
+    def holidays(self):
+        """
+        Sorted, unique int32 YYYYMMDD holidays (downloaded and extra)
+        """
+        with self.lock:
+            if self._holidays is None:
+                dates = self.load_holidays() + self.extra_holidays
+                self._holidays = np.unique(
+                    np.array(
+                        [int(date.replace("-", "")) for date in dates], dtype=np.int32
+                    )
+                )
+                self._busdaycal = np.busdaycalendar(
+                    holidays=int32_to_datetime64(self._holidays)
+                )
+            return self._holidays
+
+    @property
+    def busdaycal(self):
+        """
+        numpy busdaycalendar with the holidays
+        """
+        # Built together with the holidays array
+        self.holidays
+        return self._busdaycal
+
+    def is_holiday(self, dates):
+        """
+        Vectorized holiday lookup
+
+        Parameters
+        ----------
+        dates : array-like
+            YYYYMMDD int values
+
+        Returns
+        -------
+        ndarray
+            Boolean mask, True where the date is a holiday
+        """
+        holidays = self.holidays
+        dates = np.asarray(dates, dtype=np.int32)
+        if not len(holidays):
+            return np.zeros(len(dates), dtype=bool)
+        positions = np.searchsorted(holidays, dates).clip(max=len(holidays) - 1)
+        return holidays[positions] == dates
+
+    def trading_days(self, start, end):
+        """
+        Returns the trading days between two YYYYMMDD dates (inclusive)
+        as int32 YYYYMMDD values
+        """
+        days = np.arange(
+            int32_to_datetime64(start)[()],
+            int32_to_datetime64(end)[()] + 1,
+            dtype="datetime64[D]",
+        )
+        return datetime64_to_int32(days[np.is_busday(days, busdaycal=self.busdaycal)])
+
+    def expected_bars(self, start, end):
+        """
+        Number of trading days between YYYYMMDD dates (inclusive),
+        vectorized over arrays of start and end dates
+        """
+        return np.busday_count(
+            int32_to_datetime64(start),
+            int32_to_datetime64(end) + np.timedelta64(1, "D"),
+            busdaycal=self.busdaycal,
+        )
+
+    def missing_dates(self, dates):
+        """
+        Trading days without a bar between the first and last of `dates`
+
+        Parameters
+        ----------
+        dates : array-like
+            Sorted YYYYMMDD int values of one ticker
+        """
+        dates = np.asarray(dates, dtype=np.int32)
+        if not len(dates):
+            return dates
+        return np.setdiff1d(
+            self.trading_days(dates[0], dates[-1]), dates, assume_unique=True
+        )
@@ -0,0 +1,159 @@
+# Long-running IEXCloud quote poller that only emits changed rows
+
+import time
+import threading
+import pandas as pd
+
+# Local imports
+from iexcloud import token, format_dict, request_raw_quotes
+from common.db_sink import SQLiteSink
+from common.instrumentation import LatencyHistogram, write_reports
+
+
+COLUMNS = ["ticker", "date", "open", "high", "low", "last", "updated"]
+
+
+class QuotePoller:
+    """
+    Refreshes the quotes of a list of tickers on a schedule
+
+    The last latestUpdate of every ticker is kept in a dict, and each
+    cycle only the rows whose latestUpdate changed are passed to
+    `on_change`, so downstream writes can be incremental.
+
+    Parameters
+    ----------
+    esignals : list
+        eSignal codes used to query IEXCloud
+    tickers : list
+        Symbols each eSignal is mapped back to
+    on_change : callable
+        Called with a DataFrame of the changed rows
+    interval : float, optional
+        Seconds between the start of two cycles
+    base_url : str, optional
+    max_workers : int, optional
+        Batch requests sent at the same time
+    client : HttpClient, optional
+        HTTP client, defaults to the shared one
+    """
+
+    def __init__(
+        self,
+        esignals,
+        tickers,
+        on_change,
+        interval=60,
+        base_url="https://cloud.iexapis.com",
+        max_workers=8,
+        client=None,
+    ):
+        self.esignals = esignals
+        self.tickers = tickers
+        self.on_change = on_change
+        self.interval = interval
+        self.base_url = base_url
+        self.max_workers = max_workers
+        self.client = client
+
+        # Ticker -> latestUpdate (epoch ms) of the last emitted quote
+        self.snapshot = {}
+        self.stop_event = threading.Event()
+
+        self.cycles = 0
+        self.rows_changed = 0
+        self.last_rows_changed = 0
+        self.cycle_latency = LatencyHistogram()
+
+    def poll_once(self):
+        """
+        Runs a single refresh cycle
+
+        Returns
+        -------
+        DataFrame
+            Rows whose latestUpdate changed since the last cycle
+        """
+        start = time.perf_counter()
+        raw_quotes = request_raw_quotes(
+            self.base_url,
+            self.esignals,
+            self.tickers,
+            token,
+            self.max_workers,
+            self.client,
+            ttl=0,
+        )
+
+        changed = []
+        for esignal, ticker, ticker_dict in raw_quotes:
+            latest_update = ticker_dict.get("latestUpdate")
+            if latest_update is None or self.snapshot.get(ticker) == latest_update:
+                continue
+            try:
+                changed.append(format_dict(ticker_dict, ticker))
+            except Exception as e:
+                print(f"Error with {esignal}, error: {e}")
+                continue
+            self.snapshot[ticker] = latest_update
+
+        df = pd.DataFrame(changed, columns=COLUMNS)
+        if not df.empty:
+            self.on_change(df)
+
+        elapsed = time.perf_counter() - start
+        self.cycles += 1
+        self.rows_changed += len(df)
+        self.last_rows_changed = len(df)
+        self.cycle_latency.observe(elapsed)
+        print(f"Cycle {self.cycles}: {len(df)} rows changed in {elapsed:.2f}s")
+        return df
+
+    def run(self, max_cycles=None):
+        """
+        Polls until stop() is called or `max_cycles` cycles have run
+        """
+        while not self.stop_event.is_set():
+            start = time.perf_counter()
+            try:
+                self.poll_once()
+            except Exception as e:
+                self.cycles += 1
+                print(f"Error in cycle {self.cycles}: {e}")
+            if max_cycles is not None and self.cycles >= max_cycles:
+                break
+            self.stop_event.wait(max(0.0, self.interval - (time.perf_counter() - start)))
+
+    def stop(self):
+        self.stop_event.set()
+
+    def stats(self):
+        """
+        Returns the cycle and rows-changed counters and the cycle latency
+        """
+        return {
+            "cycles": self.cycles,
+            "rows_changed": self.rows_changed,
+            "last_rows_changed": self.last_rows_changed,
+            "cycle_latency": self.cycle_latency.to_dict(),
+        }
+
+
+if __name__ == "__main__":
+    active_tickers = pd.read_csv("active_tickers.csv", encoding="utf-8-sig")
+
+    # Only the changed rows are upserted on every cycle
+    sink = SQLiteSink("quotes.db", "quotes", key_columns=("ticker", "date"))
+    poller = QuotePoller(
+        active_tickers["eSignal"].tolist(),
+        active_tickers["Symbol"].tolist(),
+        on_change=sink.write,
+    )
+    try:
+        poller.run()
+    except KeyboardInterrupt:
+        print(poller.stats())
+        print(sink.stats())
+    finally:
+        sink.close()
+        write_reports("iex_poller_stages")
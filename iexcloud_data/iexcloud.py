@@ -1,19 +1,28 @@
 # Imports
-import requests
+import time
 import pandas as pd
 from datetime import datetime
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
 
 # Local imports
 from keys import iexcloud_keys
+from common.db_sink import SQLiteSink
+from common.http_client import get_default_client
+from common.instrumentation import profile, stage, write_reports
 
 # Parameters
 token = iexcloud_keys["token"]
 keys_to_delete = ["latestUpdate", "latestPrice"]
+quote_fields = "latestUpdate,open,high,low,latestPrice"
+
+# The batch endpoint accepts up to 100 symbols per request
+batch_size = 100
 
 # Functions
 
 
-def request_ticker_data(base_url, ticker, token):
+def request_ticker_data(base_url, ticker, token, client=None):
     """
     Gets the latest price, open, high, and low for a given ticker.
 
@@ -25,18 +34,137 @@ def request_ticker_data(base_url, ticker, token):
         ticker
     token : str
         IEXCloud token
+    client : HttpClient, optional
+        HTTP client, defaults to the shared one
 
     Returns
     -------
     dict
         Dictionary data
     """
-    quote_path = f"/stable/stock/{ticker}/quote?token={token}&filter=latestUpdate,open,high,low,latestPrice"
+    quote_path = f"/stable/stock/{ticker}/quote?token={token}&filter={quote_fields}"
     url = base_url + quote_path
-    ticker_dict = requests.get(url).json()
+    client = client or get_default_client()
+    response = client.get(url)
+    with stage("json_decode"):
+        ticker_dict = response.json()
     return ticker_dict
 
 
+def request_batch_data(base_url, symbols, token, client=None, ttl=None):
+    """
+    Gets the latest price, open, high, and low for up
+    to 100 tickers in a single request.
+
+    Parameters
+    ----------
+    base_url : str
+        base url for request
+    symbols : list
+        tickers
+    token : str
+        IEXCloud token
+    client : HttpClient, optional
+        HTTP client, defaults to the shared one
+    ttl : float, optional
+        Cache TTL for the request, 0 always hits the API
+
+    Returns
+    -------
+    dict
+        Dictionary data for each ticker returned
+    """
+    symbols_param = ",".join(quote(symbol, safe="") for symbol in symbols)
+    batch_path = f"/stable/stock/market/batch?symbols={symbols_param}&types=quote&filter={quote_fields}&token={token}"
+    client = client or get_default_client()
+    response = client.get(base_url + batch_path, ttl=ttl)
+    response.raise_for_status()
+    with stage("json_decode"):
+        data = response.json()
+    return {symbol: symbol_data["quote"] for symbol, symbol_data in data.items()}
+
+
+def request_raw_quotes(
+    base_url, esignals, tickers, token, max_workers=8, client=None, ttl=None
+):
+    """
+    Gets the unformatted quote of every ticker, sending the batch
+    requests concurrently.
+
+    Parameters
+    ----------
+    base_url : str
+        base url for request
+    esignals : list
+        eSignal codes used to query IEXCloud
+    tickers : list
+        Symbols each eSignal is mapped back to
+    token : str
+        IEXCloud token
+    max_workers : int, optional
+        Batch requests sent at the same time
+    client : HttpClient, optional
+        HTTP client, defaults to the shared one
+    ttl : float, optional
+        Cache TTL for the requests, 0 always hits the API
+
+    Returns
+    -------
+    list
+        (esignal, ticker, dictionary data) tuples, in the order of esignals
+    """
+    batches = [
+        (esignals[i : i + batch_size], tickers[i : i + batch_size])
+        for i in range(0, len(esignals), batch_size)
+    ]
+
+    def request_batch(batch):
+        batch_esignals, batch_tickers = batch
+        try:
+            with stage("quote_batch", item=f"{batch_esignals[0]}-{batch_esignals[-1]}"):
+                quotes = request_batch_data(base_url, batch_esignals, token, client, ttl)
+        except Exception as e:
+            print(f"Error with batch {batch_esignals[0]}-{batch_esignals[-1]}, error: {e}")
+            return []
+
+        raw_quotes = []
+        for esignal, ticker in zip(batch_esignals, batch_tickers):
+            ticker_dict = quotes.get(esignal) or quotes.get(esignal.upper())
+            if ticker_dict is None:
+                print(f"Error with {esignal}, error: not in batch response")
+                continue
+            raw_quotes.append((esignal, ticker, ticker_dict))
+        return raw_quotes
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(request_batch, batches)
+        return [raw_quote for raw_quotes in results for raw_quote in raw_quotes]
+
+
+def request_quotes(base_url, esignals, tickers, token, max_workers=8, client=None):
+    """
+    Gets the formatted quotes of every ticker, sending the batch
+    requests concurrently.
+
+    Parameters are the same as request_raw_quotes()
+
+    Returns
+    -------
+    list
+        Formatted dictionaries, in the order of esignals
+    """
+    ticker_dicts = []
+    for esignal, ticker, ticker_dict in request_raw_quotes(
+        base_url, esignals, tickers, token, max_workers, client
+    ):
+        try:
+            with stage("formatting"):
+                ticker_dicts.append(format_dict(ticker_dict, ticker))
+        except Exception as e:
+            print(f"Error with {esignal}, error: {e}")
+    return ticker_dicts
+
+
 def format_dict(ticker_dict, ticker):
     """
     Formats the dictionary data from request_ticker_data().
@@ -60,26 +188,33 @@ def format_dict(ticker_dict, ticker):
 
 # PIPELINE
 
-# Aqui los leo de un csv, pero esto puede cambiar y que sea de la db
-active_tickers = pd.read_csv("active_tickers.csv", encoding="utf-8-sig")
-
-# Lista de tickers y esignals
-tickers = active_tickers["Symbol"].tolist()
-esignals = active_tickers["eSignal"].tolist()
-
-# Sacar datos de cada uno de los tickers
-ticker_dicts = []
-for esignal, ticker in zip(esignals, tickers):
-    try:
-        ticker_dict = request_ticker_data("https://cloud.iexapis.com", esignal, token)
-        clean_dict = format_dict(ticker_dict, ticker)
-        ticker_dicts.append(clean_dict)
-    except Exception as e:
-        print(f"Error with {esignal}, error: {e}")
-
-
-# Formatting dataframe
-df = pd.DataFrame(ticker_dicts)
-df = df[["ticker", "date", "open", "high", "low", "last", "updated"]]
-
-# TO DO:  Aqui faltaria la parte de subir/reemplazar los datos en la db
+# Only runs as a script, so the functions can be imported (e.g. by iex_poller)
+if __name__ == "__main__":
+    # Aqui los leo de un csv, pero esto puede cambiar y que sea de la db
+    active_tickers = pd.read_csv("active_tickers.csv", encoding="utf-8-sig")
+
+    # Lista de tickers y esignals
+    tickers = active_tickers["Symbol"].tolist()
+    esignals = active_tickers["eSignal"].tolist()
+
+    # Sacar datos de todos los tickers en batches concurrentes
+    start = time.perf_counter()
+    with profile():
+        ticker_dicts = request_quotes(
+            "https://cloud.iexapis.com", esignals, tickers, token
+        )
+    print(
+        f"Refreshed {len(ticker_dicts)} of {len(tickers)} tickers "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+
+    # Formatting dataframe
+    df = pd.DataFrame(ticker_dicts)
+    df = df[["ticker", "date", "open", "high", "low", "last", "updated"]]
+
+    # Subir/reemplazar los datos en la db, una fila por ticker y fecha
+    sink = SQLiteSink("quotes.db", "quotes", key_columns=("ticker", "date"))
+    with stage("db_write"):
+        sink.write(df)
+    sink.close()
+    write_reports("iexcloud_stages")
@@ -0,0 +1,107 @@
+# Moto-backed tests of the ranged URL-to-S3 transfers
+#
+# Run from the repository root: python -m pytest tests
+
+import os
+import boto3
+import pytest
+from moto import mock_aws
+
+# Local imports
+from common.retry import RetryPolicy
+from common.s3_upload import (
+    MIN_PART_SIZE,
+    MultipartUploader,
+    RangedTransfer,
+    TruncatedRangeError,
+)
+
+
+BUCKET = "test-bucket"
+
+
+@pytest.fixture
+def s3_client():
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def payload(size):
+    return os.urandom(size)
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError(f"status {self.status_code}")
+
+    def close(self):
+        pass
+
+
+class RangeServer:
+    """
+    Serves Range requests of `data`, truncating the first response
+    for the ranges that start at one of `truncate` and answering 500
+    for the ranges that start at one of `fail`
+    """
+
+    def __init__(self, data, truncate=(), fail=()):
+        self.data = data
+        self.truncate = set(truncate)
+        self.fail = set(fail)
+        self.requests = []
+
+    def send(self, url, headers=None, stream=False, timeout=None):
+        start, stop = headers["Range"][len("bytes=") :].split("-")
+        start, stop = int(start), int(stop) + 1
+        self.requests.append(start)
+        if start in self.fail:
+            return FakeResponse(500)
+        body = self.data[start:stop]
+        if start in self.truncate:
+            self.truncate.remove(start)
+            body = body[: len(body) // 2]
+        content_range = f"bytes {start}-{stop - 1}/{len(self.data)}"
+        return FakeResponse(206, body, {"Content-Range": content_range})
+
+
+def ranged_transfer(server, s3_client, tmp_path):
+    return RangedTransfer(
+        server,
+        MultipartUploader(s3_client, part_size=MIN_PART_SIZE, max_concurrency=1),
+        checkpoint_dir=str(tmp_path),
+        retry=RetryPolicy(base_delay=0, retry_on=(TruncatedRangeError,)),
+    )
+
+
+def test_truncated_part_is_retried(s3_client, tmp_path):
+    data = payload(2 * MIN_PART_SIZE + 1024)
+    server = RangeServer(data, truncate=[MIN_PART_SIZE])
+    transfer = ranged_transfer(server, s3_client, tmp_path)
+
+    transfer.transfer("https://example.com/diario.pdf", BUCKET, "diario.pdf")
+
+    # Size probe, then parts 1, 2 (truncated), 2 again and 3
+    assert server.requests == [0, 0, MIN_PART_SIZE, MIN_PART_SIZE, 2 * MIN_PART_SIZE]
+    assert s3_client.get_object(Bucket=BUCKET, Key="diario.pdf")["Body"].read() == data
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_http_errors_are_left_to_the_client(s3_client, tmp_path):
+    # The client retries HTTP errors with its own policy, so the transfer
+    # doesn't retry them again
+    data = payload(2 * MIN_PART_SIZE + 1024)
+    server = RangeServer(data, fail=[MIN_PART_SIZE])
+    transfer = ranged_transfer(server, s3_client, tmp_path)
+
+    with pytest.raises(IOError):
+        transfer.transfer("https://example.com/diario.pdf", BUCKET, "diario.pdf")
+    assert server.requests.count(MIN_PART_SIZE) == 1
@@ -0,0 +1,55 @@
+# Moto-backed tests of the resumable multipart uploads
+#
+# Run from the repository root: python -m pytest tests
+
+import os
+import boto3
+import pytest
+from moto import mock_aws
+
+# Local imports
+from common.s3_upload import MIN_PART_SIZE, MultipartUploader
+
+
+BUCKET = "test-bucket"
+
+
+@pytest.fixture
+def s3_client():
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def payload(size):
+    return os.urandom(size)
+
+
+def test_interrupted_upload_resumes_missing_parts(s3_client, tmp_path, monkeypatch):
+    data = payload(2 * MIN_PART_SIZE + 1024)
+    path = tmp_path / "file.bin"
+    path.write_bytes(data)
+    uploader = MultipartUploader(s3_client, part_size=MIN_PART_SIZE, max_concurrency=1)
+
+    sent = []
+    upload_part = s3_client.upload_part
+
+    def failing_upload_part(**kwargs):
+        sent.append(kwargs["PartNumber"])
+        if kwargs["PartNumber"] == 3 and sent.count(3) == 1:
+            raise IOError("connection lost")
+        return upload_part(**kwargs)
+
+    monkeypatch.setattr(s3_client, "upload_part", failing_upload_part)
+
+    with pytest.raises(IOError):
+        uploader.upload_file(str(path), BUCKET, "file.bin")
+    assert os.path.exists(str(path) + ".upload.json")
+    assert sent == [1, 2, 3]
+
+    # Parts 1 and 2 match their ETags in S3, so only part 3 is sent again
+    uploader.upload_file(str(path), BUCKET, "file.bin")
+    assert sent == [1, 2, 3, 3]
+    assert not os.path.exists(str(path) + ".upload.json")
+    assert s3_client.get_object(Bucket=BUCKET, Key="file.bin")["Body"].read() == data
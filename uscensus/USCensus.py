@@ -1,23 +1,214 @@
 # Author: Federico Dominguez Molina
 # Description: This script extracts the data from the US Census API.
 
-import requests
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+import itertools
+import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Local imports
+from common.http_client import get_default_client
+from common.instrumentation import stage
+
+
+ESTIMATE_SUFFIX = "-Estimate"
+MARGIN_SUFFIX = "-Margin of Error"
+DEFAULT_METADATA_DIR = os.path.join(tempfile.gettempdir(), "uscensus-metadata")
+
+_default_metadata_cache = None
+_default_metadata_cache_lock = threading.Lock()
+
+
+class MetadataCache:
+    """
+    On-disk cache of the prebuilt mapping_dict and dataset_info of tables
+
+    Table metadata doesn't depend on the geography, so entries are keyed
+    by table id and vintage (estimate type and year) only. A new vintage
+    gets a new key, so it is always downloaded.
+
+    Parameters
+    ----------
+    cache_dir : str, optional
+        Folder where entries are stored
+    """
+
+    def __init__(self, cache_dir=DEFAULT_METADATA_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.key_locks = {}
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, table_id, type_estimate, year):
+        return os.path.join(
+            self.cache_dir, f"ACSDT{type_estimate}{year}.{table_id}.json"
+        )
+
+    def key_lock(self, table_id, type_estimate, year):
+        """
+        Returns the lock of a table vintage, held while it is loaded so
+        concurrent extractions download its metadata only once
+        """
+        with self.lock:
+            return self.key_locks.setdefault(
+                (table_id, type_estimate, year), threading.Lock()
+            )
+
+    def get(self, table_id, type_estimate, year):
+        """
+        Returns the cached (mapping_dict, dataset_info), or None
+        """
+        key = (table_id, type_estimate, year)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            try:
+                with open(self._path(*key), "r", encoding="utf-8") as file:
+                    entry = json.load(file)
+            except (OSError, ValueError):
+                entry = None
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries[key] = entry
+            self.hits += 1
+        return entry["mapping_dict"], entry["dataset_info"]
+
+    def put(self, table_id, type_estimate, year, mapping_dict, dataset_info):
+        """
+        Stores the mapping_dict and dataset_info of a table vintage
+        """
+        key = (table_id, type_estimate, year)
+        entry = {"mapping_dict": mapping_dict, "dataset_info": dataset_info}
+        path = self._path(*key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(entry, file)
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.entries[key] = entry
+
+    def stats(self):
+        """
+        Returns the hit/miss counters
+        """
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+def get_default_metadata_cache():
+    """
+    Returns the metadata cache shared by all USCensus instances
+    """
+    global _default_metadata_cache
+    with _default_metadata_cache_lock:
+        if _default_metadata_cache is None:
+            _default_metadata_cache = MetadataCache()
+        return _default_metadata_cache
+
+
+def variable_index(mapping_dict):
+    """
+    Splits the variables of a mapping dictionary into label codes and
+    estimate / margin of error flags
+
+    Returns
+    -------
+    tuple
+        Variable ids, their label codes, an is-estimate mask and the
+        (sorted) labels the codes point to
+    """
+    ids = np.array(list(mapping_dict), dtype=object)
+    # Variables end in E (estimate) or M (margin of error)
+    is_estimate = np.array([variable[-1] == "E" for variable in ids], dtype=bool)
+    labels = [
+        mapping_dict[variable][: -len(ESTIMATE_SUFFIX)]
+        if estimate
+        else mapping_dict[variable][: -len(MARGIN_SUFFIX)]
+        for variable, estimate in zip(ids, is_estimate)
+    ]
+    labels = pd.Categorical(labels)
+    return ids, labels.codes, is_estimate, labels.categories
+
+
+def parse_data_table(rows, mapping_dict):
+    """
+    Parses the rows of a data table into one row per geography and label
+
+    Parameters
+    ----------
+    rows : list
+        Header with the variable ids followed by one row per geography
+    mapping_dict : dict
+        Variable id -> label, as built by USCensus.get_mapping_dict()
+
+    Returns
+    -------
+    DataFrame
+        label, estimate, margin of error and location columns
+    """
+    header = pd.Index(rows[0])
+    values = np.array(rows[1:], dtype=object).reshape(len(rows) - 1, len(header))
+    ids, codes, is_estimate, categories = variable_index(mapping_dict)
+
+    positions = header.get_indexer(ids)
+    found = positions >= 0
+    estimate, margin = found & is_estimate, found & ~is_estimate
+
+    # Geography x label matrices, filled by position in a single assignment
+    n_geographies, n_labels = len(values), len(categories)
+    estimates = np.full((n_geographies, n_labels), None, dtype=object)
+    margins = np.full((n_geographies, n_labels), None, dtype=object)
+    estimates[:, codes[estimate]] = values[:, positions[estimate]]
+    margins[:, codes[margin]] = values[:, positions[margin]]
+
+    df = pd.DataFrame(
+        {
+            "label": np.tile(np.asarray(categories, dtype=object), n_geographies),
+            "estimate": estimates.ravel(),
+            "margin of error": margins.ravel(),
+            "location": np.repeat(values[:, header.get_loc("NAME")], n_labels),
+        }
+    )
+    return df.dropna(subset=["estimate", "margin of error"], how="all").reset_index(
+        drop=True
+    )
 
 
 class USCensus:
-    def __init__(self, year_to_query=2021, type_estimate="1Y"):
+    def __init__(
+        self,
+        year_to_query=2021,
+        type_estimate="1Y",
+        table_id="B25040",
+        geography="160XX00US0643000",
+        client=None,
+        metadata_cache=None,
+    ):
         if type_estimate not in ["1Y", "5Y"]:
             raise ValueError('type_estimate must be either "1Y" or "5Y"')
+        self.client = client or get_default_client()
+        self.metadata_cache = metadata_cache or get_default_metadata_cache()
         self.year_to_query = year_to_query
         self.type_estimate = type_estimate
-        self.API_METADATA = f"https://data.census.gov/api/search/metadata/table?id=ACSDT{self.type_estimate}{self.year_to_query}.B25040&g=160XX00US0643000"
-        self.API_TABLE = f"https://data.census.gov/api/access/data/table?id=ACSDT{self.type_estimate}{self.year_to_query}.B25040&g=160XX00US0643000"
+        self.table_id = table_id
+        self.geography = geography
+        self.set_urls()
 
         self.headers = {
             "authority": "data.census.gov",
             "method": "GET",
-            "path": f"/table?q=B25040&g=160XX00US0643000&tid=ACSDT1Y{self.year_to_query}.B25040",
+            "path": f"/table?q={self.table_id}&g={self.geography}&tid=ACSDT1Y{self.year_to_query}.{self.table_id}",
             "scheme": "https",
             "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.7",
             "Accept-Encoding": "gzip, deflate, br",
@@ -34,12 +225,21 @@ class USCensus:
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36",
         }
 
+    def set_urls(self):
+        """
+        Builds the API URLs for the current year, estimate, table and geography
+        """
+        query = f"id=ACSDT{self.type_estimate}{self.year_to_query}.{self.table_id}&g={self.geography}"
+        self.API_METADATA = f"https://data.census.gov/api/search/metadata/table?{query}"
+        self.API_TABLE = f"https://data.census.gov/api/access/data/table?{query}"
+
     def get_metadata_content(self):
         """
         Gets metadata content from API
         """
-        r = requests.get(self.API_METADATA, headers=self.headers)
-        self.metadata_content = r.json()
+        r = self.client.get(self.API_METADATA, headers=self.headers)
+        with stage("json_decode"):
+            self.metadata_content = r.json()
         self.dataset_info = self.metadata_content["response"]["metadataContent"][
             "dataset"
         ]
@@ -60,48 +260,46 @@ class USCensus:
 
             corresponding_ids = item["item_mapping"]
             for corresponding_id in corresponding_ids:
-                if "E" in corresponding_id:
-                    self.mapping_dict[corresponding_id] = f"{label}-Estimate"
+                if corresponding_id.endswith("E"):
+                    self.mapping_dict[corresponding_id] = label + ESTIMATE_SUFFIX
                 else:
-                    self.mapping_dict[corresponding_id] = f"{label}-Margin of Error"
+                    self.mapping_dict[corresponding_id] = label + MARGIN_SUFFIX
+
+    def load_metadata(self):
+        """
+        Sets mapping_dict and dataset_info, from the metadata cache when
+        the table vintage was already seen
+
+        Other geographies of the same vintage wait on its lock while the
+        metadata is downloaded, then read it from the cache.
+        """
+        key = (self.table_id, self.type_estimate, self.year_to_query)
+        with self.metadata_cache.key_lock(*key):
+            cached = self.metadata_cache.get(*key)
+            if cached is not None:
+                self.mapping_dict, self.dataset_info = cached
+                return
+            self.get_metadata_content()
+            self.get_mapping_dict()
+            self.metadata_cache.put(*key, self.mapping_dict, self.dataset_info)
 
     def get_data_table(self):
         """
         Gets data table from API and parses the data
         into a clean dataframe
         """
-        LABEL_INDEX = 0
-        DATA_INDEX = 1
-        r = requests.get(self.API_TABLE, headers=self.headers)
-        table_content = r.json()["response"]
-
-        labels = table_content["data"][LABEL_INDEX]
-        data = table_content["data"][DATA_INDEX]
+        r = self.client.get(self.API_TABLE, headers=self.headers)
+        with stage("json_decode"):
+            table_content = r.json()["response"]
 
-        df = pd.DataFrame.from_dict({"labels": labels, "data": data})
-        self.location = df.loc[df["labels"] == "NAME"]["data"].values[LABEL_INDEX]
-        df = df.loc[df["labels"].isin(self.mapping_dict.keys())]
-        df.replace(self.mapping_dict, inplace=True)
-        df.dropna(inplace=True)
-
-        # Split 'labels' into 'label' and 'metric'
-        df[["label", "metric"]] = df["labels"].str.rsplit("-", n=1, expand=True)
-
-        # Pivot to get 'Estimate' and 'Margin of Error' as separate columns
-        df_pivot = df.pivot(index="label", columns="metric", values="data")
-
-        # Reset index
-        df_pivot = df_pivot.reset_index()
-
-        # Rename columns
-        df_pivot.columns.name = ""
-        df_pivot.rename(
-            columns={"Estimate": "estimate", "Margin of Error": "margin of error"},
-            inplace=True,
+        with stage("dataframe_build"):
+            self.parsed_data = parse_data_table(
+                table_content["data"], self.mapping_dict
+            )
+        self.location = (
+            self.parsed_data["location"].iloc[0] if len(self.parsed_data) else None
         )
 
-        self.parsed_data = df_pivot
-
     def complete_df(self):
         """
         Completes dataframe with dataset information
@@ -110,7 +308,6 @@ class USCensus:
         self.parsed_data["name"] = self.dataset_info["name"]
         self.parsed_data["program"] = self.dataset_info["program"]
         self.parsed_data["subprogram"] = self.dataset_info["subProgram"]
-        self.parsed_data["location"] = self.location
 
     def extract_data(self):
         """
@@ -120,9 +317,7 @@ class USCensus:
             f"Extracting data from US Census API, {self.year_to_query}, {self.type_estimate}"
         )
         try:
-            self.get_metadata_content()
-            print("Obtained metadata content")
-            self.get_mapping_dict()
+            self.load_metadata()
             print("Obtained mapping dictionary")
             self.get_data_table()
             print("Obtained data table")
@@ -137,8 +332,9 @@ class USCensus:
     def run(self, year_to_query, type_estimate):
         """Calls census API and returns parsed data"""
 
-        self.API_METADATA = f"https://data.census.gov/api/search/metadata/table?id=ACSDT{type_estimate}{year_to_query}.B25040&g=160XX00US0643000"
-        self.API_TABLE = f"https://data.census.gov/api/access/data/table?id=ACSDT{type_estimate}{year_to_query}.B25040&g=160XX00US0643000"
+        self.year_to_query = year_to_query
+        self.type_estimate = type_estimate
+        self.set_urls()
         try:
             self.extract_data()
             data = self.parsed_data
@@ -147,3 +343,110 @@ class USCensus:
             data = pd.DataFrame()
 
         return data
+
+
+def census_grid(
+    years,
+    type_estimates=("1Y",),
+    table_ids=("B25040",),
+    geographies=("160XX00US0643000",),
+):
+    """
+    Returns every (year, type_estimate, table_id, geography) combination
+    """
+    return list(itertools.product(years, type_estimates, table_ids, geographies))
+
+
+def extract_grid(grid, max_workers=8, client=None, metadata_cache=None):
+    """
+    Extracts several years, estimate types, tables and geographies at once
+
+    Every combination of the grid is extracted in a thread of a pool, so
+    their metadata and data requests run concurrently over the shared
+    HTTP client.
+
+    Parameters
+    ----------
+    grid : list
+        (year, type_estimate, table_id, geography) tuples, e.g. from census_grid()
+    max_workers : int, optional
+        Combinations extracted at the same time
+    client : HttpClient, optional
+        HTTP client, defaults to the shared one
+    metadata_cache : MetadataCache, optional
+        Defaults to the shared one
+
+    Returns
+    -------
+    tuple
+        Long-format DataFrame with one row per label of every combination,
+        and a dict of combination -> error message for the failed ones
+    """
+    client = client or get_default_client()
+    metadata_cache = metadata_cache or get_default_metadata_cache()
+
+    def extract(year, type_estimate, table_id, geography):
+        census = USCensus(
+            year,
+            type_estimate,
+            table_id,
+            geography,
+            client=client,
+            metadata_cache=metadata_cache,
+        )
+        with stage("census_table", item=(year, type_estimate, table_id, geography)):
+            census.load_metadata()
+            census.get_data_table()
+            census.complete_df()
+        df = census.parsed_data
+        df["type_estimate"] = type_estimate
+        df["table_id"] = table_id
+        df["geography"] = geography
+        return df
+
+    frames, errors = [], {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(extract, *request): request for request in grid}
+        for future in as_completed(futures):
+            request = futures[future]
+            try:
+                frames.append(future.result())
+            except Exception as e:
+                errors[request] = str(e)
+
+    print(f"Extracted {len(frames)} of {len(grid)} census tables, {len(errors)} errors")
+    data = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+    return data, errors
+
+
+def benchmark(n_labels=500, n_geographies=1000, repeat=5):
+    """
+    Times parse_data_table on a synthetic wide table
+
+    Returns
+    -------
+    dict
+        Mean seconds per parse and parsed rows per second
+    """
+    mapping_dict = {}
+    for i in range(n_labels):
+        mapping_dict[f"B99999_{i:03d}E"] = f"Label {i}" + ESTIMATE_SUFFIX
+        mapping_dict[f"B99999_{i:03d}M"] = f"Label {i}" + MARGIN_SUFFIX
+    header = ["GEO_ID", "NAME"] + list(mapping_dict)
+    rows = [header] + [
+        [f"160XX00US{j:07d}", f"Place {j}"]
+        + [str(value) for value in np.random.randint(0, 10**6, len(mapping_dict))]
+        for j in range(n_geographies)
+    ]
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        df = parse_data_table(rows, mapping_dict)
+    seconds = (time.perf_counter() - start) / repeat
+    return {"seconds": seconds, "rows": len(df), "rows_per_sec": len(df) / seconds}
+
+
+if __name__ == "__main__":
+    # Usage: python -m uscensus.USCensus [n_labels] [n_geographies]
+    args = [int(arg) for arg in sys.argv[1:3]]
+    print(benchmark(*args))